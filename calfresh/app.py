@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 """This is the main application for controlling the three core services
 
-The app runs the WebCrawler, Worker, and DataLoader.
+The app runs the WebCrawler, Worker, and DataLoader for every table as a graph
+of jobs, so each table is worked as soon as it's crawled and loaded as soon as
+it's worked, while the other tables carry on. In pipeline mode the tables stream
+through the three services instead, connected by bounded queues
 
 Attributes:
     config (RawConfigParser): for reading the configuration file
@@ -9,13 +12,17 @@ Attributes:
 
 """
 
+from functools import partial
 import ConfigParser
 import logging
 
+from catalog import FileCatalog
 from constants import table_url_map
 from data_loader import DataLoader
+from pipeline import Pipeline
+from scheduler import Scheduler, Skip
 from web_crawler import WebCrawler
-from worker import Worker
+from worker import OUTPATH, MergeResults, Worker, start_pool, stop_pool
 
 config = ConfigParser.RawConfigParser()
 config.read('/etc/calfresh/calfresh.conf')
@@ -23,26 +30,77 @@ config.read('/etc/calfresh/calfresh.conf')
 logger = logging.getLogger('root')
 
 
-if __name__ == '__main__':
+def crawl(table):
+    """Crawl a table's page for new files
 
-    logger.info('starting...')
+    Raises:
+        Skip: If there's nothing new, so the table isn't worked or loaded
+
+    """
+    if not WebCrawler(table, table_url_map[table]).crawl():
+        raise Skip('no new data')
+
+
+def work(table, catalog, results):
+    """Convert, process and merge a table's files
+
+    Returns:
+        datapath (str): the directory of the merged files
+
+    """
+    return Worker(table, catalog, results).work()
+
+
+def combine(catalog, results):
+    """Build tbl_dfa358tot out of the merged tbl_dfa358f and tbl_dfa358s"""
+    Worker('tbl_dfa358tot', catalog, results).combine_358F_and_S()
 
-    datapath = None
-    for table in table_url_map.keys():
-        try:
-            crawler = WebCrawler(table, table_url_map[table])
-            new_table_data = crawler.crawl()
 
-            if new_table_data:
-                worker = Worker(new_table_data)
-                datapath = worker.work()
+def load(table):
+    """Load a table's merged files into the database"""
+    DataLoader().load(OUTPATH, table)
 
-        except Exception as ex:
-            logger.exception(ex)
 
-    if datapath:
-        loader = DataLoader()
-        loader.load(datapath)
+def build_graph(scheduler, catalog, results):
+    """Add the crawl, work and load jobs of every table to the scheduler
+
+    Args:
+        scheduler (Scheduler): the scheduler to run the jobs
+        catalog (FileCatalog): the index of the data directory
+        results (MergeResults): the tables merged during the run
+
+    """
+    for table in sorted(table_url_map):
+        scheduler.add('crawl:' + table, partial(crawl, table), kind='crawl')
+        scheduler.add('work:' + table, partial(work, table, catalog, results),
+                      ['crawl:' + table], kind='work')
+        scheduler.add('load:' + table, partial(load, table),
+                      ['work:' + table], kind='load')
+
+    # the total needs both tables merged, and is built if either one changed
+    scheduler.add('work:tbl_dfa358tot', partial(combine, catalog, results),
+                  ['work:tbl_dfa358f', 'work:tbl_dfa358s'], kind='work')
+    scheduler.add('load:tbl_dfa358tot', partial(load, 'tbl_dfa358tot'),
+                  ['work:tbl_dfa358tot'], kind='load')
+
+
+if __name__ == '__main__':
+
+    logger.info('starting...')
+
+    catalog = FileCatalog()
+    results = MergeResults()
+    # the workers' processes are forked before the crawl threads start
+    start_pool()
+    try:
+        if config.get('app', 'mode') == 'pipeline':
+            Pipeline(table_url_map, catalog, results).run()
+        else:
+            scheduler = Scheduler()
+            build_graph(scheduler, catalog, results)
+            scheduler.run()
+    finally:
+        stop_pool()
 
-    crawler.clean_up()
+    WebCrawler.clean_up()
     logger.info('finished')
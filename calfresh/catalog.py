@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""This module indexes the data directory so the Worker can look up a table's
+    files without walking the whole tree every time
+
+The data directory is laid out as <data>/<table>/<stage>/<filename>, where
+the stage is one of xlsx, csv_in or csv_out
+
+Attributes:
+    config (RawConfigParser): for reading the configuration file
+    INPATH (str): the data directory to index
+
+"""
+
+from collections import defaultdict
+from os import listdir, walk, sep
+from os.path import isdir, isfile, join, relpath
+import ConfigParser
+import threading
+
+config = ConfigParser.RawConfigParser()
+config.read('/etc/calfresh/calfresh.conf')
+
+INPATH = config.get('filepaths', 'data')
+
+
+class FileCatalog(object):
+    """Every data file indexed by table and stage, built with a single walk of
+        the data directory and kept up to date as files are added and removed
+
+    Args:
+        root (str): the data directory to index
+
+    Attributes:
+        files (dict): (table, stage) tuples mapped to dicts of filename to the
+            item representing the file
+
+    """
+    def __init__(self, root=INPATH):
+        super(FileCatalog, self).__init__()
+        self.root = root
+        self.lock = threading.Lock()
+        self.files = defaultdict(dict)
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the catalog from a single walk of the data directory"""
+        files = defaultdict(dict)
+        for root, dirs, names in walk(self.root):
+            parts = relpath(root, self.root).split(sep)
+            if len(parts) != 2:  # only <table>/<stage> directories hold data files
+                continue
+
+            for name in names:
+                files[tuple(parts)][name] = self._item(join(root, name))
+
+        with self.lock:
+            self.files = files
+
+    def refresh_stage(self, table, stage):
+        """Rebuild the catalog's entries for a table's stage from its directory,
+            picking up files written by something that didn't add them
+
+        Args:
+            table (str): the table the files belong to
+            stage (str): xlsx, csv_in or csv_out
+
+        """
+        directory = join(self.root, table, stage)
+        files = {}
+        if isdir(directory):
+            for name in listdir(directory):
+                path = join(directory, name)
+                if isfile(path):
+                    files[name] = self._item(path)
+
+        with self.lock:
+            self.files[(table, stage)] = files
+
+    def get(self, table, stage):
+        """Get the files of a table in a stage
+
+        Args:
+            table (str): the table the files belong to
+            stage (str): xlsx, csv_in or csv_out
+
+        Returns:
+            paths (list of dicts): contains the dict objects representing
+            the path, source, and filename of each file, sorted by filename
+
+        """
+        with self.lock:
+            items = self.files.get((table, stage), {})
+            return [dict(items[name]) for name in sorted(items)]
+
+    def add(self, path):
+        """Add a file that was just written
+
+        Args:
+            path (str): the path to the file, inside the data directory
+
+        """
+        item = self._item(path)
+        with self.lock:
+            self.files[self._key(path)][item['filename']] = item
+
+    def remove(self, path):
+        """Forget a file that was just deleted or moved out of the data directory
+
+        Args:
+            path (str): the path the file used to have
+
+        """
+        filename = relpath(path, self.root).split(sep)[-1]
+        with self.lock:
+            self.files[self._key(path)].pop(filename, None)
+
+    def _key(self, path):
+        """Get the (table, stage) a file belongs to from its path"""
+        parts = relpath(path, self.root).split(sep)
+        return parts[0], parts[1]
+
+    def _item(self, path):
+        """Build the dict the Worker and the factories use to represent a file"""
+        return {
+            'path': path,
+            'source': self._key(path)[0],
+            'filename': relpath(path, self.root).split(sep)[-1],
+        }
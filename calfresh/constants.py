@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """As the name suggests, this file contains (almost?) all the constants we need:
     - The tablenames and their web urls
+    - The sheets to skip when converting each table's excel files
     - The county sets
     - Column names for all the tables
 
@@ -20,6 +21,39 @@ table_url_map = {
     'tbl_stat47': url_prefix + 'Research-and-Data/CalFresh-Data-Tables/STAT-47',
 }
 
+# junk_sheet_map has the patterns marking sheets without relevant data for each
+# table, matched against the csv filename (<workbook>-<sheet>.csv) the sheet would
+# be converted to. Tables not listed only skip data dictionaries
+junk_sheet_map = {
+    'tbl_cf15': [],
+    'tbl_cf296': ['DataDictionary', 'Statewide', 'Release Summary', 'Report View'],
+    'tbl_churn_data': ['DataDictionary'],
+    'tbl_data_dashboard': [
+        'DataDictionary',
+        'Trend',
+        'Updates',
+        'PRI_eval',
+        'Pivot',
+        'Main',
+        'Geomap',
+        'Dual_Part',
+        'Tiered',
+        '_US',
+    ],
+    'tbl_dfa256': ['DataDictionary', 'Statewide', 'Release Summary', 'Report View'],
+    'tbl_dfa296': ['DataDictionary', 'Statewide', 'Release Summary'],
+    'tbl_dfa296x': ['DataDictionary', 'Statewide', 'Release Summary'],
+    'tbl_dfa358f': ['DataDictionary', 'Statewide', 'Release Summary'],
+    'tbl_dfa358s': ['DataDictionary', 'Statewide', 'Release Summary'],
+    'tbl_stat47': ['DataDictionary', 'Statewide', 'Release Summary'],
+    'tbl_stat48': ['DataDictionary', '0.csv'],
+}
+junk_sheet_default = ['DataDictionary']
+
+# merge_keys are the columns identifying a row of every table, so the rows for
+# the same county and month from different files are merged into one
+merge_keys = ['county', 'fulldate']
+
 # county_dict has keys stripped of all whitespace for use in the cleanCounties function
 # in the file_factory module
 county_dict = {
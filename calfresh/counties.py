@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Resolves the county names found in the sheets, which come with stray spaces
+    and typos, to the names the database uses
+
+Misspellings are matched to the nearest county with BK-trees over the county
+names, one for each length, since a name can't be fewer edits from a county
+than the difference in their lengths. The trees only measure the edit distance
+to the counties that could be close enough instead of to every one of them. The
+same misspellings turn up in file after file, so the counties they resolve to
+are remembered too, and the names confirmed by a file whose counties all
+checked out are handed back as aliases that resolve without any matching
+
+Attributes:
+    config (RawConfigParser): for reading the configuration file
+    CACHE_SIZE (int): how many misspellings a resolver remembers
+    MAX_EDITS (int): a name needs fewer edits than this to be taken for a
+        county, since some counties only have four letters
+
+"""
+
+from collections import OrderedDict, defaultdict
+import ConfigParser
+
+import editdistance
+import numpy as np
+
+import constants
+
+config = ConfigParser.RawConfigParser()
+config.read('/etc/calfresh/calfresh.conf')
+
+CACHE_SIZE = config.getint('counties', 'cache_size')
+MAX_EDITS = 3
+
+
+class BKTree(object):
+    """A metric tree of words for finding the words within some edit distance
+        of another one
+
+    Each child of a word is filed under its distance from the word, so by the
+    triangle inequality a search only has to go down the children whose
+    distance is within the radius of the distance to the word being searched
+
+    Args:
+        words (list of str): the words to search
+
+    """
+    def __init__(self, words):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        """Add a word to the tree, unless it's already in it"""
+        if self.root is None:
+            self.root = (word, {})
+            return
+
+        node, children = self.root
+        while True:
+            distance = editdistance.eval(word, node)
+            if distance == 0:
+                return
+            if distance not in children:
+                children[distance] = (word, {})
+                return
+            node, children = children[distance]
+
+    def search(self, word, radius):
+        """Find the words of the tree within some edit distance of a word
+
+        Args:
+            word (str): the word to search for
+            radius (int): the most edits a match can be from the word
+
+        Returns:
+            matches (list of tuples): the distance and word of each match
+
+        """
+        matches = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node, children = nodes.pop()
+            distance = editdistance.eval(word, node)
+            if distance <= radius:
+                matches.append((distance, node))
+
+            nodes.extend(
+                child for edge, child in children.items()
+                if distance - radius <= edge <= distance + radius
+            )
+        return matches
+
+
+class CountyResolver(object):
+    """Resolves raw county names to the names of the counties, remembering the
+        misspellings it has seen
+
+    Args:
+        counties (dict): the county names without their spaces mapped to the
+            names, like constants.county_dict
+        cache_size (int): how many misspellings to remember, dropping the one
+            seen least recently when there are too many
+        aliases (dict): raw names already known to stand for a county, like
+            CountyAliases.get_all returns
+
+    Attributes:
+        cache (OrderedDict): the misspellings mapped to the counties they
+            resolved to, the one seen most recently last
+
+    """
+    def __init__(self, counties=constants.county_dict, cache_size=CACHE_SIZE, aliases=None):
+        self.counties = counties
+        self.names = set(counties.values())
+        # ties go to the county that comes first, so the results don't depend
+        # on the shape of the tree
+        self.order = dict((key, i) for i, key in enumerate(counties))
+        self.trees = defaultdict(list)
+        for key in counties:
+            self.trees[len(key)].append(key)
+        self.trees = dict((length, BKTree(keys)) for length, keys in self.trees.items())
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.aliases = {}
+        self.learn(aliases or {})
+
+    def resolve(self, county):
+        """Get the county a raw name stands for
+
+        Args:
+            county (str or unicode): the name as it was found, without
+                surrounding spaces. Typed storage reads text back as unicode
+
+        Returns:
+            str or NaN: the name of the county, or NaN if the name isn't text
+            or isn't within MAX_EDITS of any county
+
+        """
+        if isinstance(county, unicode):
+            county = county.encode('utf-8')
+        if county in self.names:
+            return county
+        if county in self.aliases:
+            return self.aliases[county]
+        if type(county) != str:
+            return np.nan
+
+        if county in self.cache:
+            resolved = self.cache.pop(county)
+        else:
+            resolved = self.get_closest(county.replace(' ', ''))
+
+        self.cache[county] = resolved
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return resolved
+
+    def get_closest(self, county):
+        """Get the county with the fewest edits from a name, or NaN
+
+        Args:
+            county (str): the name without its spaces
+
+        Returns:
+            str or NaN: the name of the county, or NaN if none are close enough
+
+        """
+        radius = MAX_EDITS - 1
+        matches = []
+        for length in range(len(county) - radius, len(county) + radius + 1):
+            if length in self.trees:
+                matches.extend(self.trees[length].search(county, radius))
+
+        if not matches:
+            return np.nan
+
+        _, closest = min(matches, key=lambda match: (match[0], self.order[match[1]]))
+        return self.counties[closest]
+
+    def resolve_all(self, counties):
+        """Resolve a column of raw names, each distinct name once
+
+        Args:
+            counties (pandas Series): the names as they were found
+
+        Returns:
+            pandas Series: the names of the counties, with NaN for the names
+            that couldn't be resolved
+
+        """
+        resolved = dict(
+            (county, self.resolve(county)) for county in counties.dropna().unique()
+        )
+        return counties.map(resolved).astype(object)
+
+    def get_new_aliases(self, raw, resolved):
+        """Get the names of a column that had to be matched to a county
+
+        Names that didn't resolve to a county are left out, since the totals,
+        notes and run dates under the counties change from file to file and
+        would pile up as aliases that are never looked up again
+
+        Args:
+            raw (pandas Series): the names as they were resolved
+            resolved (pandas Series): the counties resolve_all returned for them
+
+        Returns:
+            aliases (dict): each name that isn't a county or a known alias
+            mapped to the county it resolved to
+
+        """
+        pairs = zip(raw.values, resolved.values)
+        return dict(
+            (county, name) for county, name in (
+                (county.encode('utf-8') if isinstance(county, unicode) else county, name)
+                for county, name in pairs
+            )
+            if type(county) == str and type(name) == str
+            and county not in self.names and county not in self.aliases
+        )
+
+    def learn(self, aliases):
+        """Resolve the aliases by lookup from now on
+
+        Args:
+            aliases (dict): raw names mapped to the counties they stand for
+
+        """
+        for county, name in aliases.items():
+            self.aliases[county] = name
+            self.cache.pop(county, None)
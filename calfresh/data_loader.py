@@ -23,7 +23,7 @@ logger = logging.getLogger('data_loader')
 class DataLoader(object):
     """Load the data into the database!"""
 
-    def load(self, datapath):
+    def load(self, datapath, table=None):
         """Load the data in the date-named directory using a subprocess
 
         Here we extract the filenames from the directory, get the headers for each,
@@ -32,11 +32,16 @@ class DataLoader(object):
 
         Args:
             datapath (str): formatted as '/etc/calfresh/MM_DD_YYYY'
+            table (str): only load this table's files, so it can be loaded as
+                soon as it's ready. All the files are loaded if it's None
 
         """
         with open('/etc/calfresh/logs/calfresh.log', 'a') as logfile:
             for root, dirs, files in walk(datapath):
                 for table_name in files:
+                    if table is not None and not self.is_table_file(table, table_name):
+                        continue
+
                     logger.info('Loading %s', table_name)
                     with open(join(datapath, table_name)) as csvfile:
                         header = csv.reader(csvfile, delimiter=',').next()
@@ -57,3 +62,17 @@ class DataLoader(object):
                         except Exception as ex:
                             logger.exception(ex)
 
+    def is_table_file(self, table, filename):
+        """Check if an output file belongs to a table
+
+        Args:
+            table (str): the table, like tbl_dfa296
+            filename (str): the output file, like tbl_dfa296.csv, or like
+                tbl_data_dashboard_annual.csv for tables with several files
+
+        Returns:
+            bool: True if the file is the table's. tbl_dfa296x.csv isn't
+            tbl_dfa296's
+
+        """
+        return filename == table + '.csv' or filename.startswith(table + '_')
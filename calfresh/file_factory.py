@@ -8,15 +8,16 @@ TODOs:
 """
 
 from abc import ABCMeta, abstractmethod
-from string import digits
 import ConfigParser
 import logging.config
+import re
 
-from xlrd.xldate import xldate_as_datetime
-import editdistance
 import numpy as np
 import pandas as pd
 
+from counties import CountyResolver
+from state import CountyAliases
+from storage import storage_for
 import constants
 
 config = ConfigParser.RawConfigParser()
@@ -25,6 +26,32 @@ config.read('/etc/calfresh/calfresh.conf')
 logging.config.fileConfig(config.get('filepaths', 'config'))
 logger = logging.getLogger('file_factory')
 
+# bump this whenever a change to the factories changes what they output, so
+# the Worker rebuilds workbooks it would otherwise reuse
+FACTORY_VERSION = 1
+
+# the text float reads as a number, and what _get_valid_numbers strips from
+# any other text before trying it again
+NUMBER = re.compile(
+    r'^\s*[-+]?((\d+\.?\d*|\.\d+)(e[-+]?\d+)?|inf(inity)?|nan)\s*$',
+    re.IGNORECASE,
+)
+NON_NUMERIC = re.compile(r'[^0-9.]')
+
+# excel counts days from here, pretending 1900 was a leap year, so the serials
+# before its made up Feb 29th count from a day later
+EXCEL_EPOCH = '1899-12-30'
+EXCEL_LEAP_DAY = 60
+MONTHS = np.array(
+    ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+)
+
+# shared by the factories built in a process, so each misspelled county is
+# only matched once however many files it turns up in, and starting from the
+# aliases confirmed on previous runs so those aren't matched at all
+county_aliases = CountyAliases()
+county_resolver = CountyResolver(aliases=county_aliases.get_all())
+
 
 def initialize(item):
     """Initializes the proper FileFactory object based on the source directory
@@ -81,15 +108,20 @@ class FileFactory(object):
         year (int): the year (yyyy) pertaining to the data within the factory
         quarter (int) the quarter pertaining to the data within the factory
         month (str): the month (MMM) pertaining to the data within the factory
+        dated (bool): whether add_excel_dates has added the quarter already
 
     """
     __metaclass__ = ABCMeta
 
     def __init__(self, item):
         self.filename = item['filename']
-        self.df = pd.read_csv(item['path'])
+        if 'df' in item:
+            self.df = item['df']  # read straight from the workbook
+        else:
+            self.df = storage_for(item['path']).read(item['path'])
         if self.df.empty:
             raise ValueError
+        self.dated = False
         super(FileFactory, self).__init__()
 
     def __str__(self):
@@ -143,8 +175,45 @@ class FileFactory(object):
         """Month is passed in as a string or slice of the filename"""
         self.df['month'] = month.upper()
 
+    def add_excel_dates(self, col):
+        """Replace a column of excel serial dates with year, month and quarter columns
+
+        The dates are read the way xlrd's xldate_as_datetime reads them from a
+        workbook in the 1900 date system, but all at once, and each distinct
+        date only once since a file covers a few months at most
+
+        Args:
+            col (str): the column with the dates in excel number format
+
+        Sets:
+            df['year'] (pandas Series): the year (yyyy) of each date, as text
+            df['month'] (pandas Series): the month (MMM) of each date
+            df['quarter'] (pandas Series): the quarter of each date, as a float
+
+        Raises:
+            ValueError: If any of the dates is missing
+
+        """
+        serials, rows = np.unique(self.df[col].values.astype(float), return_inverse=True)
+        if np.isnan(serials).any():
+            logging.error('Missing dates in %s', self.filename)
+            raise ValueError
+
+        days = np.where(serials >= EXCEL_LEAP_DAY, serials, serials + 1)
+        dates = pd.DatetimeIndex(pd.to_datetime(days, unit='D', origin=EXCEL_EPOCH))
+        self.df['year'] = dates.year.astype(str).astype(object)[rows]
+        self.df['month'] = MONTHS[dates.month - 1][rows]
+        self.df['quarter'] = dates.quarter.values.astype(float)[rows]
+        self.df.drop(col, axis=1, inplace=True)
+        self.dated = True
+
     def add_quarter(self):
-        """Map the month to the quarter"""
+        """Map the month to the quarter, unless add_excel_dates already has"""
+        if self.dated:
+            # after the columns the factory added since, like the others
+            self.df['quarter'] = self.df.pop('quarter')
+            return
+
         quarters = {
             'JAN': 1.0,
             'FEB': 1.0,
@@ -173,73 +242,75 @@ class FileFactory(object):
 
         """
         for col in self.df.columns[startCol:endCol]:
-            i = 0
-            for row in self.df[col]:
-                self.df.loc[i, col] = self._get_valid_number(row)
-                i += 1
-
-    def _get_valid_number(self, num):
-        """Extract a number from the input arg or return None
-
-        Args:
-            num (str): a value from a cell assumed to contain numeric values
-
-        Returns:
-            float or None: float if there were numeric values in the arg,
-            or None if it was just junk
-
-        """
-        if num is None:
-            return np.nan
+            # columns read as numbers have nothing to clean
+            if self.df[col].dtype.kind not in 'iuf':
+                self.df[col] = self._get_valid_numbers(self.df[col])
 
-        try:
-            return float(num)
-        except ValueError:
-            return self._convert_to_number(num)
+    def _get_valid_numbers(self, values):
+        """Extract a number from each value of a column, a column at a time
 
-    def _convert_to_number(self, num):
-        """Remove all non-numeric characters from the input
+        Text that float reads is converted by float, and other text has
+        everything but digits and points stripped off before it's tried again
 
         Args:
-            num (str): a string representation of a number
+            values (pandas Series): a column assumed to contain numeric values
 
         Returns:
-            float stripped of all non-numerics or None
+            pandas Series: floats, or NaN where a value was just junk, as
+            objects like the column they replace
 
         """
-        if num is None:
-            return np.nan
-
-        temp = num
-        for c in temp:
-            if c not in digits + '.':
-                num = num.replace(c, '')
-
         try:
-            return float(num)
-        except ValueError:
-            return np.nan
+            # nothing to strip when every value reads as a number
+            numbers = values.values.astype(float)
+            return pd.Series(numbers, index=values.index).astype(object)
+        except (TypeError, ValueError):  # typed storage reads blanks as None
+            pass
+
+        # plain arrays for the masks, which pandas indexes a lot faster than Series
+        numbers = pd.Series(np.nan, index=values.index)
+
+        text = values.map(type).isin([str, unicode]).values
+        readable = values.notnull().values & ~text
+        if text.any():
+            readable[text] = values.loc[text].str.match(NUMBER).values
+        numbers.values[readable] = values.values[readable].astype(float)
+
+        junk = text & ~readable
+        if junk.any():
+            stripped = values.loc[junk].str.replace(NON_NUMERIC, '')
+            matched = stripped.str.match(NUMBER).values
+            numbers.values[np.flatnonzero(junk)[matched]] = \
+                stripped.values[matched].astype(float)
+
+        return numbers.astype(object)
 
     def check_percents(self, cols):
         """Check and standardize all percentages to fall between -1.00 and 1.00
 
+        Any value over 1.00 or under -1.00 is taken to be a whole percentage and
+        divided by 100. Nulls and text are left as they are
+
         Args:
             cols (list of str): columns that should contain percent values
 
         """
-        for col in cols:
-            if col in self.df.columns:
-                i = 0
-                for row in self.df[col]:
-                    if row > 1.0 or row < -1.0:
-                        self.df.loc[i, col] = row / 100.0
-                    i += 1
+        cols = [col for col in cols if col in self.df.columns]
+        if not cols:
+            return
+
+        percents = self.df[cols].apply(pd.to_numeric, errors='coerce')
+        # NaN is never over 1.00, so the nulls and the text are masked out
+        whole = percents.abs() > 1.0
+        self.df[cols] = self.df[cols].mask(whole, percents / 100.0)
 
     def check_counties(self, col=0):
         """Make sure all counties are present
 
         This function checks that all counties are there and if any are misspelled
-        it tries to identify which county it might be
+        it tries to identify which county it might be. Once they're all there,
+        the names that had to be matched are saved as aliases, so later runs
+        look them up
 
         Args:
             col (int): the column to scan for county names
@@ -251,7 +322,9 @@ class FileFactory(object):
         # get the string value of the column name
         col = self.df.columns[col]
 
+        raw = self.df[col].str.strip()
         self._clean_county_names(col)
+        aliases = county_resolver.get_new_aliases(raw, self.df[col])
 
         self.df[col] = self.df[col].replace({'Statewide': 'California'})
 
@@ -267,6 +340,10 @@ class FileFactory(object):
             )
             raise ValueError
 
+        if aliases:
+            county_aliases.record(aliases, self.filename)
+            county_resolver.learn(aliases)
+
     def _trim_noncounty_rows(self, col):
         """Remove any blank row from the county column
 
@@ -283,57 +360,7 @@ class FileFactory(object):
             col (str): the column with observable county names
 
         """
-        self.df[col] = self.df[col].str.strip()
-        i = 0
-        for county in self.df[col]:
-            if county not in constants.county_set:
-                if type(county) == str:
-                    county = county.replace(' ', '')
-                    closest = self._get_closest_spelled_county(county)
-                    self.df.loc[i, col] = closest
-                else:
-                    self.df.loc[i, col] = np.nan
-            i += 1
-
-    def _get_nearest_spelled_counties(self, county):
-        """Get county names with the shortest edit distance to the county arg
-
-        Args:
-            county (str): the invalid county name
-
-        Returns:
-            A dict of county names whose edit distance is less than 3 from the arg
-
-        """
-        vals = {}
-        for key in constants.county_dict.keys():
-            county = str(county)
-            # Less than three is best since some counties only have four letters
-            if len(county) < (len(key) + 3) and len(county) > (len(key) - 3):
-                vals[key] = editdistance.eval(key, county)
-
-        return vals
-
-    def _get_closest_spelled_county(self, county):
-        """Get the county with the smallest edit distance or None
-
-        Args:
-            county (str): invalid county name to replace
-
-        Returns:
-            A valid county name or None if there were none within 3 edits
-
-        """
-        potentials = self._get_nearest_spelled_counties(county)
-        if not potentials:
-            return np.nan
-
-        closest = min(potentials, key=potentials.get)
-        # Needs to have fewer than three edits made
-        if potentials[closest] < 3L:
-            return constants.county_dict[closest]
-        else:
-            return np.nan
+        self.df[col] = county_resolver.resolve_all(self.df[col].str.strip())
 
     def trim_bogus_columns(self):
         """Drop columns off the end of the table with more than a quarter empty rows"""
@@ -368,22 +395,15 @@ class CF296Factory(FileFactory):
     def build_specific(self):
         self.check_numbers()
         # dates in this column come in excel number format
-        date_info = [
-            xldate_as_datetime(xldate, 0) for xldate in self.df[self.df.columns[1]]
-        ]
-
-        self.df['year'] = [pydate.strftime('%Y').upper() for pydate in date_info]
-        self.df['month'] = [pydate.strftime('%b').upper() for pydate in date_info]
-
-        self.df.drop(self.df.columns[1], axis=1, inplace=True)
-        self.df.columns = constants.CF296Columns
+        self.add_excel_dates(self.df.columns[1])
+        self.df.columns = constants.CF296Columns + ['quarter']
 
 
 class ChurnDataFactory(FileFactory):
 
     def build_specific(self):
         self.check_numbers()
-        if self.filename[0] in digits:
+        if self.filename[0].isdigit():
             self.add_year(self.filename[2:4])
         else:
             self.add_year(self.filename[4:6])
@@ -507,27 +527,20 @@ class DFA256Factory(FileFactory):
     def build_specific(self):
         self.check_numbers()
         # dates in this column come in excel number format
-        date_info = [
-            xldate_as_datetime(xldate, 0) for xldate in self.df[self.df.columns[1]]
-        ]
-
-        self.df['year'] = [pydate.strftime('%Y').upper() for pydate in date_info]
-        self.df['month'] = [pydate.strftime('%b').upper() for pydate in date_info]
-
-        self.df.drop(self.df.columns[1], axis=1, inplace=True)
+        self.add_excel_dates(self.df.columns[1])
         # some logic for determining columns in the file based on date follows...
         if self.df.year.unique()[0] == 2002 or \
                 (self.df.year.unique()[0] == 2003 and
                     self.df.month.unique()[0] in ['JAN', 'FEB', 'MAR']):
-            self.df.columns = constants.DFA256Columns1
+            self.df.columns = constants.DFA256Columns1 + ['quarter']
 
         elif self.df.year.unique()[0] == 2003 and \
                 self.df.month.unique()[0] in \
                 ['APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT']:
-            self.df.columns = constants.DFA256Columns2
+            self.df.columns = constants.DFA256Columns2 + ['quarter']
 
         else:
-            self.df.columns = constants.DFA256Columns3
+            self.df.columns = constants.DFA256Columns3 + ['quarter']
         # we precompute this for ease of user analysis
         self.df['total_households'] = (
             self.df.num_hh_pub_asst_fed +
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Runs the crawl, work and load stages as a pipeline, so downloading one
+    table overlaps working the table before it and loading the one before that
+
+The stages are threads connected by bounded queues. When the worker falls
+behind, the crawlers block on the full queue instead of piling up downloads
+it hasn't got to, and the same goes for the worker when the loader falls behind
+
+Attributes:
+    config (RawConfigParser): for reading the configuration file
+    logger (Logger): the object for logging
+    CRAWLERS (int): how many tables are crawled at the same time
+    QUEUE_SIZE (int): how many tables can wait between two stages
+
+"""
+
+from collections import OrderedDict
+from Queue import Empty, Queue
+from threading import Lock, Thread
+import ConfigParser
+import logging.config
+import time
+import traceback
+
+from data_loader import DataLoader
+from web_crawler import WebCrawler
+from worker import OUTPATH, Worker, start_pool, stop_pool
+
+config = ConfigParser.RawConfigParser()
+config.read('/etc/calfresh/calfresh.conf')
+
+logging.config.fileConfig(config.get('filepaths', 'config'))
+logger = logging.getLogger('pipeline')
+
+CRAWLERS = config.getint('pipeline', 'crawlers')
+QUEUE_SIZE = config.getint('pipeline', 'queue_size')
+
+# tells the next stage nothing else is coming
+FINISHED = None
+
+# the 358 total is built once both of its tables have been through the worker
+TOTAL = 'tbl_dfa358tot'
+TOTAL_PARTS = ('tbl_dfa358f', 'tbl_dfa358s')
+
+
+class Pipeline(object):
+    """Crawls, works and loads tables in stages that overlap
+
+    Args:
+        table_url_map (dict): the tables mapped to the urls for their data
+        catalog (FileCatalog): the index of the data directory
+        results (MergeResults): the tables merged during the run
+        crawlers (int): how many tables to crawl at the same time
+        queue_size (int): how many tables can wait between two stages
+
+    Attributes:
+        stats (OrderedDict): for each table, the stages it went through mapped
+            to how they went (done, skipped or failed) and how long they took
+
+    """
+    def __init__(self, table_url_map, catalog, results,
+                 crawlers=CRAWLERS, queue_size=QUEUE_SIZE):
+        self.table_url_map = table_url_map
+        self.catalog = catalog
+        self.results = results
+        self.crawlers = crawlers
+
+        self.crawl_queue = Queue()
+        self.work_queue = Queue(maxsize=queue_size)
+        self.load_queue = Queue(maxsize=queue_size)
+
+        self.stats = OrderedDict()
+        self._lock = Lock()
+
+    def run(self):
+        """Run every table through the stages and wait for the last load
+
+        The Worker's pool of processes is started first, if it isn't already,
+        so no process is forked once the stage threads are running
+
+        Returns:
+            stats (OrderedDict): how each stage went for each table
+
+        """
+        for table in sorted(self.table_url_map):
+            self.crawl_queue.put(table)
+
+        started_pool = start_pool()
+        try:
+            self.run_stages()
+        finally:
+            if started_pool:
+                stop_pool()
+
+        self.report()
+        return self.stats
+
+    def run_stages(self):
+        """Start a thread for each stage and wait for them all to finish"""
+        crawlers = [
+            Thread(target=self.crawl, name='crawler-{}'.format(number))
+            for number in xrange(max(1, self.crawlers))
+        ]
+        worker = Thread(target=self.work, name='worker')
+        loader = Thread(target=self.load, name='loader')
+        for thread in crawlers + [worker, loader]:
+            thread.daemon = True
+            thread.start()
+
+        for thread in crawlers:
+            thread.join()
+        self.work_queue.put(FINISHED)
+        worker.join()
+        loader.join()
+
+    def crawl(self):
+        """Crawl tables until there are none left, handing each to the worker"""
+        while True:
+            try:
+                table = self.crawl_queue.get_nowait()
+            except Empty:
+                return
+
+            crawler = WebCrawler(table, self.table_url_map[table])
+            status, changed = self.run_stage(table, 'crawl', crawler.crawl)
+            if status == 'done' and not changed:
+                self.record(table, 'crawl', 'skipped', self.stats[table]['crawl'][1])
+
+            # blocks while the worker is behind
+            self.work_queue.put((table, status == 'done' and bool(changed)))
+
+    def work(self):
+        """Work each crawled table with new data, handing it to the loader
+
+        Every table comes through, changed or not, so the total can be built
+        as soon as both of its tables are settled
+        """
+        settled = {}
+        while True:
+            item = self.work_queue.get()
+            if item is FINISHED:
+                break
+
+            table, changed = item
+            if changed:
+                # built in the stage, so a Worker that can't start fails its table
+                settled[table], _ = self.run_stage(
+                    table,
+                    'work',
+                    lambda: Worker(table, self.catalog, self.results).work(),
+                )
+            else:
+                settled[table] = 'skipped'
+
+            if settled[table] == 'done':
+                self.load_queue.put(table)
+
+            if table in TOTAL_PARTS and all(part in settled for part in TOTAL_PARTS):
+                self.work_total(settled)
+
+        self.load_queue.put(FINISHED)
+
+    def work_total(self, settled):
+        """Build the 358 total if neither of its tables failed and one changed
+
+        Args:
+            settled (dict): the tables through the worker, mapped to how it went
+
+        """
+        parts = [settled[part] for part in TOTAL_PARTS]
+        if 'failed' in parts or 'done' not in parts:
+            return
+
+        status, _ = self.run_stage(
+            TOTAL,
+            'work',
+            lambda: Worker(TOTAL, self.catalog, self.results).combine_358F_and_S(),
+        )
+        if status == 'done':
+            self.load_queue.put(TOTAL)
+
+    def load(self):
+        """Load each worked table into the database"""
+        loader = DataLoader()
+        while True:
+            table = self.load_queue.get()
+            if table is FINISHED:
+                return
+
+            self.run_stage(table, 'load', lambda: loader.load(OUTPATH, table))
+
+    def run_stage(self, table, stage, func):
+        """Run a table through a stage, catching any failure so the other
+            tables carry on
+
+        Args:
+            table (str): the table
+            stage (str): crawl, work or load
+            func (function): the stage's job for the table
+
+        Returns:
+            result (tuple): done or failed, and what the job returned
+
+        """
+        logger.info('%s: starting %s', table, stage)
+        started = time.time()
+        try:
+            result = func()
+            status = 'done'
+        except Exception:
+            logger.error('%s: %s failed: %s', table, stage, traceback.format_exc())
+            result = None
+            status = 'failed'
+
+        self.record(table, stage, status, time.time() - started)
+        return status, result
+
+    def record(self, table, stage, status, elapsed):
+        with self._lock:
+            self.stats.setdefault(table, OrderedDict())[stage] = (status, elapsed)
+
+    def report(self):
+        """Log how each stage went for each table"""
+        for table, stages in self.stats.items():
+            logger.info('%-20s %s', table, ', '.join(
+                '{} {} {:.1f}s'.format(stage, status, elapsed)
+                for stage, (status, elapsed) in stages.items()
+            ))
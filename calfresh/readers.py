@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Readers for the sheets of excel files, so the worker gets the same rows of
+values whether a workbook is an old .xls file or an .xlsx file
+
+.xls files are read by xlrd, which can load their sheets one at a time. xlrd
+reads the whole of an .xlsx file into memory before it returns a single row,
+so those are streamed a row at a time by openpyxl instead, and their values
+are converted to the ones xlrd would have returned
+
+"""
+
+from datetime import datetime, time
+from itertools import islice
+
+from openpyxl import load_workbook
+from openpyxl.utils import coordinate_to_tuple
+from openpyxl.xml.constants import SHEET_MAIN_NS
+from openpyxl.xml.functions import iterparse
+from xlrd import error_text_from_code, open_workbook
+
+VALUE_TAGS = ['{%s}v' % SHEET_MAIN_NS, '{%s}is' % SHEET_MAIN_NS]
+ROW_TAG = '{%s}row' % SHEET_MAIN_NS
+MERGE_TAG = '{%s}mergeCell' % SHEET_MAIN_NS
+
+# day 0 of excel's serial dates, the way xlrd counts them
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+error_code_from_text = dict(
+    (text, code) for code, text in error_text_from_code.items()
+)
+
+
+def has_value(cell):
+    """Check if a cell element of a sheet's xml holds a value xlrd would read
+
+    Args:
+        cell (Element): the <c> element
+
+    Returns:
+        bool: True if the cell has a value, or is a formula's string result
+
+    """
+    return cell.get('t') == 'str' or any(child.tag in VALUE_TAGS for child in cell)
+
+
+def open_reader(path):
+    """Open an excel file with the reader that suits its format
+
+    Args:
+        path (str): the path of the excel file
+
+    Returns:
+        reader (XlsReader or XlsxReader): the reader of the file's sheets
+
+    """
+    if path.endswith(('.xlsx', '.xlsm')):
+        return XlsxReader(path)
+    return XlsReader(path)
+
+
+class XlsReader(object):
+    """Reads the sheets of an .xls file with xlrd, loading each sheet only
+        while its rows are read
+
+    Attributes:
+        workbook (Book): the workbook, opened on demand
+
+    """
+    def __init__(self, path):
+        self.workbook = open_workbook(path, on_demand=True)
+
+    def sheet_names(self):
+        """Returns the names of the sheets without loading any of them"""
+        return self.workbook.sheet_names()
+
+    def rows(self, name):
+        """Read the rows of a sheet
+
+        Args:
+            name (str): the name of the sheet
+
+        Yields:
+            values (list): the values of the cells of each row
+
+        """
+        sheet = self.workbook.sheet_by_name(name)
+        try:
+            for row in xrange(sheet.nrows):
+                yield sheet.row_values(row)
+        finally:
+            self.workbook.unload_sheet(name)
+
+    def close(self):
+        """Let go of the file"""
+        self.workbook.release_resources()
+
+
+class XlsxReader(object):
+    """Streams the sheets of an .xlsx file with openpyxl, so only one row is
+        held in memory at a time
+
+    Attributes:
+        workbook (Workbook): the workbook, opened read only
+
+    """
+    def __init__(self, path):
+        self.workbook = load_workbook(path, read_only=True, data_only=True)
+
+    def sheet_names(self):
+        """Returns the names of the sheets without reading any of them"""
+        return self.workbook.sheetnames
+
+    def rows(self, name):
+        """Read the rows of a sheet
+
+        The sheet is read twice: once to find its shape, then again for the
+        values, so the rows come out the same shape as xlrd's even when
+        formatted empty cells trail past the data
+
+        Args:
+            name (str): the name of the sheet
+
+        Yields:
+            values (list): the values of the cells of each row
+
+        """
+        sheet = self.workbook[name]
+        nrows, ncols = self.get_shape(sheet)
+
+        count = 0
+        for count, row in enumerate(islice(sheet.iter_rows(), nrows), 1):
+            values = [self.get_value(cell) for cell in row[:ncols]]
+            values.extend([u''] * (ncols - len(values)))
+            yield values
+
+        # a merged range can reach past the rows the sheet says it has
+        for _ in xrange(nrows - count):
+            yield [u''] * ncols
+
+    def get_shape(self, sheet):
+        """Find how many rows and columns of a sheet xlrd would have read
+
+        That's as far as the last cell with a value or the last merged range
+        goes. Formatted cells without values don't count
+
+        Args:
+            sheet (ReadOnlyWorksheet): the sheet to measure
+
+        Returns:
+            shape (tuple): the number of rows and the number of columns
+
+        """
+        nrows, ncols = 0, 0
+        for _, element in iterparse(sheet.xml_source):
+            if element.tag == ROW_TAG:
+                # only the row's last cell with a value can move the edges
+                for cell in reversed(element):
+                    if has_value(cell):
+                        row, column = coordinate_to_tuple(cell.get('r'))
+                        nrows, ncols = max(nrows, row), max(ncols, column)
+                        break
+                element.clear()
+            elif element.tag == MERGE_TAG:
+                row, column = coordinate_to_tuple(element.get('ref').split(':')[-1])
+                nrows, ncols = max(nrows, row), max(ncols, column)
+
+        return nrows, ncols
+
+    def get_value(self, cell):
+        """Get a cell's value the way xlrd would return it
+
+        Numbers and dates are floats, since xlrd leaves dates as excel serial
+        numbers, booleans are 1 or 0, errors are their codes, and empty
+        cells are empty strings
+
+        Args:
+            cell (ReadOnlyCell or EmptyCell): the cell
+
+        Returns:
+            value (float, int, or unicode): the cell's value
+
+        """
+        if cell.data_type == 'n':
+            # the raw number, before openpyxl turns date formatted ones into dates
+            value = getattr(cell, 'internal_value', None)
+            return u'' if value is None else float(value)
+
+        value = cell.value
+        if value is None:
+            return u''
+        if cell.data_type == 'd':  # newer openpyxl hands dates over as dates
+            return self.get_serial(value)
+        if cell.data_type == 'b':
+            return int(value)
+        if cell.data_type == 'e':
+            return error_code_from_text.get(value, value)
+        return value
+
+    def get_serial(self, value):
+        """Turn a date back into the excel serial number it was stored as
+
+        Args:
+            value (datetime, date, or time): the date openpyxl read
+
+        Returns:
+            serial (float): the days since the workbook's epoch, with the time
+            of day as the fraction
+
+        """
+        if isinstance(value, time):
+            return (value.hour * 3600 + value.minute * 60 + value.second +
+                    value.microsecond / 1e6) / 86400.0
+        if not isinstance(value, datetime):
+            value = datetime.combine(value, time())
+
+        epoch = getattr(self.workbook, 'epoch', EXCEL_EPOCH)
+        if not isinstance(epoch, datetime):
+            epoch = EXCEL_EPOCH
+        delta = value - epoch
+        return delta.days + delta.seconds / 86400.0 + delta.microseconds / 864e8
+
+    def close(self):
+        """Let go of the file"""
+        self.workbook.close()
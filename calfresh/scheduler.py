@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""A small scheduler that runs a graph of jobs, each as soon as the jobs it
+    depends on are finished, so independent tables don't wait on each other
+
+Each node of the graph is a job with the names of the nodes it depends on and
+a kind, such as crawl, work or load, which caps how many nodes of that kind run
+at the same time
+
+Attributes:
+    config (RawConfigParser): for reading the configuration file
+    logger (Logger): the object for logging
+    KIND_LIMITS (dict): the most nodes of each kind to run at the same time
+
+"""
+
+from collections import OrderedDict
+from threading import Condition, Thread
+import ConfigParser
+import logging.config
+import time
+import traceback
+
+config = ConfigParser.RawConfigParser()
+config.read('/etc/calfresh/calfresh.conf')
+
+logging.config.fileConfig(config.get('filepaths', 'config'))
+logger = logging.getLogger('scheduler')
+
+KIND_LIMITS = dict(
+    (kind, config.getint('scheduler', kind)) for kind in config.options('scheduler')
+    if kind not in config.defaults()
+)
+
+WAITING = 'waiting'
+RUNNING = 'running'
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+class Skip(Exception):
+    """Raised by a job with nothing to do, so the nodes depending on it are
+        skipped too instead of failing"""
+
+
+class Node(object):
+    """A job in the graph and how it went
+
+    Args:
+        name (str): the name other nodes depend on it by
+        func (function): the job, called without arguments
+        deps (list of str): the names of the nodes it depends on
+        kind (str): the kind of job, for limiting how many run at once
+
+    Attributes:
+        status (str): waiting, running, done, skipped or failed
+        result: what the job returned
+        error (str): the traceback if it failed, or why it was skipped
+        started (float): when it started, as a timestamp
+        finished (float): when it finished, as a timestamp
+
+    """
+    def __init__(self, name, func, deps=(), kind=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.kind = kind
+        self.status = WAITING
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        """Returns the seconds it ran for, or None if it never started"""
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def run(self):
+        """Run the job, catching any failure so the rest of the graph goes on"""
+        self.started = time.time()
+        try:
+            self.result = self.func()
+            self.status = DONE
+        except Skip as ex:
+            self.error = str(ex)
+            self.status = SKIPPED
+        except Exception:
+            self.error = traceback.format_exc()
+            self.status = FAILED
+        finally:
+            self.finished = time.time()
+
+
+class Scheduler(object):
+    """Runs the nodes of a graph in threads as their dependencies finish
+
+    A node runs once all of its dependencies have finished, if none of them
+    failed and at least one of them did its job. Otherwise it's skipped
+
+    Args:
+        limits (dict): the most nodes of each kind to run at the same time.
+            Kinds not listed aren't limited
+
+    Attributes:
+        nodes (OrderedDict): the nodes by name, in the order they were added
+
+    """
+    def __init__(self, limits=None):
+        self.limits = limits if limits is not None else KIND_LIMITS
+        self.nodes = OrderedDict()
+        self._condition = Condition()
+        self._running = {}
+
+    def add(self, name, func, deps=(), kind=None):
+        """Add a node to the graph
+
+        Dependencies have to be added first, so the graph can't have cycles
+
+        Args:
+            name (str): the name other nodes depend on it by
+            func (function): the job, called without arguments
+            deps (list of str): the names of the nodes it depends on
+            kind (str): the kind of job, for limiting how many run at once
+
+        Returns:
+            node (Node): the node added
+
+        Raises:
+            ValueError: If the name is taken or a dependency hasn't been added
+
+        """
+        if name in self.nodes:
+            raise ValueError('{} was already added'.format(name))
+        for dep in deps:
+            if dep not in self.nodes:
+                raise ValueError('{} depends on unknown node {}'.format(name, dep))
+
+        node = Node(name, func, deps, kind)
+        self.nodes[name] = node
+        return node
+
+    def run(self):
+        """Run every node of the graph and wait for them all to finish
+
+        Returns:
+            nodes (OrderedDict): the nodes by name, with their status and timings
+
+        """
+        with self._condition:
+            while True:
+                for node in self._get_ready():
+                    self._start(node)
+
+                if not self._running:
+                    break
+                self._condition.wait()
+
+        self.report()
+        return self.nodes
+
+    def _get_ready(self):
+        """Get the waiting nodes that can start now, skipping the ones that won't
+
+        Returns:
+            nodes (list of Nodes): the nodes to start, in the order they were added
+
+        """
+        ready = []
+        for node in self.nodes.values():
+            if node.status != WAITING:
+                continue
+
+            deps = [self.nodes[dep] for dep in node.deps]
+            if any(dep.status in (WAITING, RUNNING) for dep in deps):
+                continue
+
+            failed = [dep.name for dep in deps if dep.status == FAILED]
+            if failed:
+                self._skip(node, '{} failed'.format(', '.join(failed)))
+            elif deps and not any(dep.status == DONE for dep in deps):
+                self._skip(node, 'nothing to do')
+            elif self._running.get(node.kind, 0) < self.limits.get(node.kind, float('inf')):
+                self._running[node.kind] = self._running.get(node.kind, 0) + 1
+                ready.append(node)
+
+        return ready
+
+    def _skip(self, node, reason):
+        node.status = SKIPPED
+        node.error = reason
+
+    def _start(self, node):
+        """Run a node in a thread of its own"""
+        node.status = RUNNING
+        logger.info('starting %s', node.name)
+        thread = Thread(target=self._run_node, args=(node,), name=node.name)
+        thread.daemon = True
+        thread.start()
+
+    def _run_node(self, node):
+        node.run()
+        if node.status == FAILED:
+            logger.error('%s failed: %s', node.name, node.error)
+        else:
+            logger.info('%s %s in %.1fs', node.name, node.status, node.elapsed)
+
+        with self._condition:
+            self._running[node.kind] -= 1
+            if not self._running[node.kind]:
+                del self._running[node.kind]
+            self._condition.notify()
+
+    def report(self):
+        """Log the status and timing of every node"""
+        for node in self.nodes.values():
+            elapsed = '{:.1f}s'.format(node.elapsed) if node.elapsed is not None else '-'
+            logger.info('%-28s %-8s %8s %s', node.name, node.status, elapsed,
+                        node.error if node.status == SKIPPED else '')
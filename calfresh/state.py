@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""This module keeps track of what the system has already seen between runs
+    in a small SQLite database, one table per kind of state
+
+Attributes:
+    config (RawConfigParser): for reading the configuration file
+    state_path (str): the SQLite database file
+    logger (Logger): the object for logging
+
+"""
+
+from contextlib import contextmanager
+import ConfigParser
+import csv
+import datetime
+import hashlib
+import json
+import logging.config
+import sqlite3
+
+config = ConfigParser.RawConfigParser()
+config.read('/etc/calfresh/calfresh.conf')
+
+state_path = config.get('filepaths', 'state')
+
+logging.config.fileConfig(config.get('filepaths', 'config'))
+logger = logging.getLogger('state')
+
+
+def _encode(text):
+    """Turn the unicode SQLite hands back into utf-8 str, leaving NULL as None"""
+    return text.encode('utf-8') if text is not None else None
+
+
+def hash_file(path, chunk_size=65536):
+    """Get the content address of a file without reading it all into memory
+
+    Args:
+        path (str): the file to hash
+        chunk_size (int): the bytes to read at a time
+
+    Returns:
+        sha256 (str), size (int): the hex digest and the number of bytes
+
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class StateStore(object):
+    """Base class for the kinds of state saved in the database
+
+    Args:
+        path (str): the SQLite database file, shared by all the stores
+
+    Attributes:
+        schema (list of str): the statements creating the store's table and indexes
+
+    """
+    schema = []
+
+    def __init__(self, path=state_path):
+        super(StateStore, self).__init__()
+        self.path = path
+        with self._connect() as conn:
+            for statement in self.schema:
+                conn.execute(statement)
+
+    @contextmanager
+    def _connect(self):
+        """Open a short lived connection, so stores can be shared between threads"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _now(self):
+        """The timestamp saved with each change"""
+        return datetime.datetime.now().isoformat()
+
+
+class FileManifest(StateStore):
+    """The content address of every excel file downloaded, so changed bytes
+        behind an unchanged url are noticed and new urls pointing at bytes we
+        already have are not
+
+    Each url maps to the SHA-256 and size of its content when it was last
+    fetched, plus the validators it responded with for conditional requests,
+    and when its content last changed, which fetching the same bytes again
+    doesn't touch
+
+    """
+    schema = [
+        """CREATE TABLE IF NOT EXISTS files (
+            url TEXT PRIMARY KEY,
+            tbl TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            fetched TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            changed TEXT
+        )""",
+        'CREATE INDEX IF NOT EXISTS files_content ON files (tbl, sha256)',
+    ]
+
+    def __init__(self, path=state_path):
+        super(FileManifest, self).__init__(path)
+        with self._connect() as conn:
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(files)')]
+            if 'changed' not in columns:  # saved before the column was added
+                conn.execute('ALTER TABLE files ADD COLUMN changed TEXT')
+                conn.execute('UPDATE files SET changed = fetched')
+
+    def get(self, url):
+        """Get what we know about the url
+
+        Args:
+            url (str): the url of the excel file
+
+        Returns:
+            dict or None: the url's saved columns, or None if it was never fetched
+
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM files WHERE url = ?', (url,)).fetchone()
+        return dict(row) if row else None
+
+    def has_content(self, table, sha256):
+        """Check if any file already downloaded for the table has these bytes
+
+        Args:
+            table (str): the table the file belongs to
+            sha256 (str): the hex digest of the file's content
+
+        Returns:
+            bool: True if the content is already on disk
+
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT 1 FROM files WHERE tbl = ? AND sha256 = ? LIMIT 1',
+                (table, sha256),
+            ).fetchone()
+        return row is not None
+
+    def filenames(self, table, sha256):
+        """Get the names of the table's files that were downloaded with these bytes
+
+        Args:
+            table (str): the table the files belong to
+            sha256 (str): the hex digest of the file's content
+
+        Returns:
+            filenames (set of str): the names the files were saved under
+
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT filename FROM files WHERE tbl = ? AND sha256 = ?',
+                (table, sha256),
+            )
+            return set(row['filename'] for row in rows)
+
+    def changed(self, table):
+        """Get when the content of each of the table's files last changed
+
+        Args:
+            table (str): the table the files belong to
+
+        Returns:
+            changed (dict): the filename of each file mapped to the timestamp
+            of the latest fetch that brought new bytes, leaving out the files
+            whose bytes were never new
+
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT filename, MAX(changed) AS changed FROM files '
+                'WHERE tbl = ? AND changed IS NOT NULL GROUP BY filename',
+                (table,),
+            )
+            return dict((row['filename'], row['changed']) for row in rows)
+
+    def record(self, url, table, filename, sha256, size, etag=None,
+               last_modified=None, changed=True):
+        """Save the content address of a file that was just fetched
+
+        Args:
+            url (str): the url of the excel file
+            table (str): the table the file belongs to
+            filename (str): the name the file is saved under
+            sha256 (str): the hex digest of the file's content
+            size (int): the number of bytes in the file
+            etag (str): the ETag the url responded with, if any
+            last_modified (str): the Last-Modified the url responded with, if any
+            changed (bool): whether the bytes were new and saved to the file,
+                rather than ones we already had
+
+        """
+        now = self._now()
+        with self._connect() as conn:
+            if not changed:
+                row = conn.execute(
+                    'SELECT changed FROM files WHERE url = ?', (url,),
+                ).fetchone()
+                changed = row['changed'] if row else None
+            else:
+                changed = now
+
+            conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, table, filename, sha256, size, now, etag, last_modified, changed),
+            )
+
+
+class LinkIndex(StateStore):
+    """Every excel link ever seen on each table's page, so new links are found
+        by a set difference against the index rather than yesterday's html
+
+    """
+    schema = [
+        """CREATE TABLE IF NOT EXISTS links (
+            tbl TEXT NOT NULL,
+            url TEXT NOT NULL,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            PRIMARY KEY (tbl, url)
+        )""",
+    ]
+
+    def urls(self, table):
+        """Get every link seen for the table
+
+        Args:
+            table (str): the table whose links to get
+
+        Returns:
+            urls (set of str): the links seen on any previous run
+
+        """
+        with self._connect() as conn:
+            rows = conn.execute('SELECT url FROM links WHERE tbl = ?', (table,))
+            return set(row['url'] for row in rows)
+
+    def record(self, table, urls):
+        """Add the links to the index, or mark them as seen again
+
+        Args:
+            table (str): the table the links were found for
+            urls (iterable of str): the links found on the table's page
+
+        """
+        now = self._now()
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO links VALUES (?, ?, ?, ?)',
+                [(table, url, now, now) for url in urls],
+            )
+            conn.executemany(
+                'UPDATE links SET last_seen = ? WHERE tbl = ? AND url = ?',
+                [(now, table, url) for url in urls],
+            )
+
+
+class BuildCache(StateStore):
+    """What the Worker built from each workbook, so workbooks that haven't changed
+        since they were last built can reuse their csv_out files
+
+    A build is only reusable if both the workbook's SHA-256 and the version of
+    the factories that built it still match
+
+    """
+    schema = [
+        """CREATE TABLE IF NOT EXISTS builds (
+            tbl TEXT NOT NULL,
+            workbook TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            outputs TEXT NOT NULL,
+            built TEXT NOT NULL,
+            PRIMARY KEY (tbl, workbook)
+        )""",
+    ]
+
+    def get(self, table, workbook):
+        """Get the last build of a workbook
+
+        Args:
+            table (str): the table the workbook belongs to
+            workbook (str): the filename of the workbook
+
+        Returns:
+            dict or None: the build's columns with outputs as a list of csv_out
+            filenames, or None if the workbook was never built
+
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT * FROM builds WHERE tbl = ? AND workbook = ?',
+                (table, workbook),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        build = dict(row)
+        build['outputs'] = json.loads(build['outputs'])
+        return build
+
+    def workbooks(self, table):
+        """Get the workbook each of the table's csv_out files was last built from
+
+        Args:
+            table (str): the table the workbooks belong to
+
+        Returns:
+            workbooks (dict): each csv_out filename mapped to its workbook's
+
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT workbook, outputs FROM builds WHERE tbl = ?', (table,),
+            ).fetchall()
+
+        return dict(
+            (output, row['workbook'])
+            for row in rows for output in json.loads(row['outputs'])
+        )
+
+    def record(self, table, workbook, sha256, version, outputs):
+        """Save a build that just finished
+
+        Args:
+            table (str): the table the workbook belongs to
+            workbook (str): the filename of the workbook
+            sha256 (str): the hex digest of the workbook that was built
+            version (int): the version of the factories that built it
+            outputs (list of str): the csv_out filenames built from it
+
+        """
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?, ?)',
+                (table, workbook, sha256, version, json.dumps(outputs), self._now()),
+            )
+
+
+class CountyAliases(StateStore):
+    """The raw names the factories have confirmed in their county columns, so a
+        name that was misspelled on a previous run is looked up instead of
+        matched by edit distance again
+
+    Each alias maps to the county it resolved to in a file whose counties all
+    checked out, along with the file it was first seen in. Names that aren't a
+    county aren't saved, and the NULL counties older runs saved are ignored
+
+    """
+    schema = [
+        """CREATE TABLE IF NOT EXISTS county_aliases (
+            alias TEXT PRIMARY KEY,
+            county TEXT,
+            filename TEXT NOT NULL,
+            first_seen TEXT NOT NULL
+        )""",
+    ]
+    columns = ['alias', 'county', 'filename', 'first_seen']
+
+    def get_all(self):
+        """Get every alias confirmed so far
+
+        Returns:
+            aliases (dict): each alias mapped to its county, as utf-8 str
+                like the names read from the files
+
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT alias, county FROM county_aliases WHERE county IS NOT NULL'
+            )
+            return dict(
+                (row['alias'].encode('utf-8'), row['county'].encode('utf-8'))
+                for row in rows
+            )
+
+    def record(self, aliases, filename):
+        """Save the aliases a file confirmed, keeping the first file each was seen in
+
+        Args:
+            aliases (dict): the raw names mapped to the counties they resolved
+                to. Names mapped to anything but a str aren't a county and
+                aren't saved
+            filename (str): the file the names were found in
+
+        """
+        now = self._now()
+        rows = []
+        for alias, county in aliases.items():
+            if type(county) != str:
+                continue
+            try:
+                rows.append((alias.decode('utf-8'), county.decode('utf-8'), filename, now))
+            except UnicodeDecodeError:
+                logger.warning('Not saving alias %r from %s, it isn\'t utf-8', alias, filename)
+
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO county_aliases VALUES (?, ?, ?, ?)', rows,
+            )
+
+    def export(self, path):
+        """Write every alias to a csv file for review
+
+        Args:
+            path (str): the csv file to write
+
+        Returns:
+            int: the number of aliases written
+
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT * FROM county_aliases WHERE county IS NOT NULL '
+                'ORDER BY county, alias'
+            ).fetchall()
+
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            for row in rows:
+                writer.writerow([_encode(row[column]) for column in self.columns])
+        return len(rows)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""How the Worker stores the files between its stages: the sheets converted to
+    csv_in and the factories' output in csv_out
+
+Feather and parquet files keep the type of each column, so the factories and
+the merge get numbers back as numbers instead of parsing them out of text at
+every stage. Both need pyarrow, so
+without it the files are stored as csv like they always were. Whatever is used
+in between, the merged tables are written out as csv for mysqlimport
+
+The files keep the names of the csv files they stand in for, with the storage's
+extension instead of .csv, so junk sheets and factories are still picked by the
+csv filename
+
+Attributes:
+    config (RawConfigParser): for reading the configuration file
+    logger (Logger): the object for logging
+    STORAGE (CsvStorage, FeatherStorage or ParquetStorage): the storage the
+        configuration file asks for, or csv if it can't be used
+
+"""
+
+from os.path import splitext
+from shutil import copy2
+import ConfigParser
+import logging.config
+
+import pandas as pd
+
+config = ConfigParser.RawConfigParser()
+config.read('/etc/calfresh/calfresh.conf')
+
+logging.config.fileConfig(config.get('filepaths', 'config'))
+logger = logging.getLogger('storage')
+
+
+def to_text(value):
+    """Write a value the way to_csv writes a value of a column of mixed types"""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def to_storable(df):
+    """Get a DataFrame ready for a columnar file
+
+    Columns have to hold a single type, so the values of a text column that
+    aren't text, like the factories' floats next to their '\\N' nulls, are
+    stored as the text the csv file would have held
+
+    Args:
+        df (pandas DataFrame): the frame to store
+
+    Returns:
+        df (pandas DataFrame): a copy with a plain index and text column names
+
+    """
+    df = df.reset_index(drop=True)
+    df.columns = [to_text(column) for column in df.columns]
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object:
+            df[column] = values.where(values.isnull(), values.map(to_text))
+    return df
+
+
+class CsvStorage(object):
+    """Stores the files as csv, which any format falls back to"""
+    name = 'csv'
+    extension = '.csv'
+    typed = False
+
+    def stored_name(self, filename):
+        """Get the name a csv file is stored under
+
+        Args:
+            filename (str): the csv filename, like DFA256FY17-18-Data.csv
+
+        Returns:
+            filename (str): the csv filename with the storage's extension
+
+        """
+        return splitext(filename)[0] + self.extension
+
+    def csv_name(self, filename):
+        """Get the name of the csv file a stored file stands in for"""
+        return splitext(filename)[0] + '.csv'
+
+    def is_stored(self, filename):
+        """Check if a file is one of the storage's, rather than left over from
+            another storage or something else in the directory"""
+        return filename.endswith(self.extension)
+
+    def write(self, df, path):
+        df.to_csv(path, index=False)
+
+    def read(self, path):
+        """Read a stored file
+
+        Args:
+            path (str): the path of the file
+
+        Returns:
+            df (pandas DataFrame): the file's data
+
+        """
+        return pd.read_csv(path)
+
+    def export(self, path, csv_path):
+        """Write a stored file out as csv, for loading into the database"""
+        copy2(path, csv_path)
+
+
+class FeatherStorage(CsvStorage):
+    """Stores the files as feather, which is quick to write and read back
+
+    Raises:
+        ImportError: If pyarrow isn't installed
+
+    """
+    name = 'feather'
+    extension = '.feather'
+    typed = True
+
+    def __init__(self):
+        from pyarrow import feather
+        self.feather = feather
+
+    def write(self, df, path):
+        self.feather.write_feather(to_storable(df), path)
+
+    def read(self, path):
+        return self.feather.read_feather(path)
+
+    def export(self, path, csv_path):
+        self.read(path).to_csv(csv_path, index=False)
+
+
+class ParquetStorage(FeatherStorage):
+    """Stores the files as parquet, which is compressed
+
+    Raises:
+        ImportError: If pyarrow isn't installed
+
+    """
+    name = 'parquet'
+    extension = '.parquet'
+
+    def __init__(self):
+        import pyarrow
+        from pyarrow import parquet
+        self.pyarrow = pyarrow
+        self.parquet = parquet
+
+    def write(self, df, path):
+        table = self.pyarrow.Table.from_pandas(to_storable(df), preserve_index=False)
+        self.parquet.write_table(table, path)
+
+    def read(self, path):
+        return self.parquet.read_table(path).to_pandas()
+
+
+STORAGES = dict(
+    (storage.name, storage) for storage in [CsvStorage, FeatherStorage, ParquetStorage]
+)
+
+
+def get_storage(name):
+    """Get the storage by its name, or csv if the storage can't be used here
+
+    Args:
+        name (str): csv, feather or parquet
+
+    Returns:
+        storage (CsvStorage, FeatherStorage or ParquetStorage): the storage
+
+    Raises:
+        ValueError: If there's no storage by that name
+
+    """
+    if name not in STORAGES:
+        raise ValueError('Unknown storage: {}'.format(name))
+
+    try:
+        return STORAGES[name]()
+    except ImportError:
+        logger.warning('%s storage needs pyarrow, storing csv instead', name)
+        return CsvStorage()
+
+
+STORAGE = get_storage(config.get('storage', 'format'))
+
+
+def storage_for(path):
+    """Get the storage to read a file with, from its extension
+
+    Anything that isn't in the current storage is read as csv, like the files
+    converted before the storage was changed and the test fixtures
+
+    Args:
+        path (str): the path of the file
+
+    Returns:
+        storage (CsvStorage, FeatherStorage or ParquetStorage): the storage
+
+    """
+    if STORAGE.is_stored(path):
+        return STORAGE
+    return CsvStorage()
@@ -0,0 +1,68 @@
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+import unittest
+
+from catalog import FileCatalog
+
+
+class TestFileCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.root = '/etc/calfresh/temp/test_catalog'
+        for stage in ['xlsx', 'csv_in', 'csv_out']:
+            makedirs(join(self.root, 'tbl_dfa256', stage))
+
+        self.xlsx = join(self.root, 'tbl_dfa256', 'xlsx', 'DFA256FY17-18.xlsx')
+        with open(self.xlsx, 'w') as f:
+            f.write('test')
+        with open(join(self.root, 'tbl_dfa256', 'manifest.json'), 'w') as f:
+            f.write('{}')
+
+        self.catalog = FileCatalog(self.root)
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_get(self):
+        self.assertEqual(self.catalog.get('tbl_dfa256', 'xlsx'), [{
+            'path': self.xlsx,
+            'source': 'tbl_dfa256',
+            'filename': 'DFA256FY17-18.xlsx',
+        }])
+        self.assertEqual(self.catalog.get('tbl_dfa256', 'csv_in'), [])
+        self.assertEqual(self.catalog.get('tbl_cf296', 'xlsx'), [])
+
+    def test_add(self):
+        csv_path = join(self.root, 'tbl_dfa256', 'csv_in', 'DFA256FY17-18-Data.csv')
+        self.catalog.add(csv_path)
+
+        paths = self.catalog.get('tbl_dfa256', 'csv_in')
+        self.assertEqual([item['path'] for item in paths], [csv_path])
+
+    def test_remove(self):
+        self.catalog.remove(self.xlsx)
+        self.assertEqual(self.catalog.get('tbl_dfa256', 'xlsx'), [])
+
+    def test_refresh(self):
+        csv_path = join(self.root, 'tbl_dfa256', 'csv_out', 'DFA256FY17-18-Data.csv')
+        with open(csv_path, 'w') as f:
+            f.write('test')
+
+        self.assertEqual(self.catalog.get('tbl_dfa256', 'csv_out'), [])
+        self.catalog.refresh()
+        self.assertEqual(len(self.catalog.get('tbl_dfa256', 'csv_out')), 1)
+
+    def test_refresh_stage(self):
+        xlsx = join(self.root, 'tbl_dfa256', 'xlsx', 'DFA256FY18-19.xlsx')
+        with open(xlsx, 'w') as f:
+            f.write('test')
+        self.catalog.remove(self.xlsx)
+
+        self.catalog.refresh_stage('tbl_dfa256', 'xlsx')
+        self.assertEqual(
+            [item['filename'] for item in self.catalog.get('tbl_dfa256', 'xlsx')],
+            ['DFA256FY17-18.xlsx', 'DFA256FY18-19.xlsx'],
+        )
+        self.catalog.refresh_stage('tbl_cf296', 'xlsx')
+        self.assertEqual(self.catalog.get('tbl_cf296', 'xlsx'), [])
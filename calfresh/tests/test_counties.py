@@ -0,0 +1,87 @@
+import unittest
+
+import editdistance
+import numpy as np
+import pandas as pd
+
+import constants
+from counties import BKTree, CountyResolver
+
+
+class TestBKTree(unittest.TestCase):
+
+    def test_search(self):
+        words = list(constants.county_dict)
+        tree = BKTree(words)
+
+        for word in ['SantaClara/a', 'Yoba', 'LosAngelas', 'Statewide', 'SSSSSSSSSS']:
+            expected = sorted(
+                (editdistance.eval(word, key), key) for key in words
+                if editdistance.eval(word, key) <= 2
+            )
+            self.assertEqual(sorted(tree.search(word, 2)), expected)
+
+        self.assertEqual(BKTree([]).search('Yolo', 2), [])
+
+
+class TestCountyResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.resolver = CountyResolver(cache_size=2)
+
+    def test_resolve(self):
+        self.assertEqual(self.resolver.resolve('Contra Costa'), 'Contra Costa')
+        self.assertEqual(self.resolver.resolve('Contra  Costa'), 'Contra Costa')
+        self.assertEqual(self.resolver.resolve('SantaClara/a'), 'Santa Clara')
+        self.assertEqual(self.resolver.resolve('Statewide'), 'Statewide')
+        np.testing.assert_equal(self.resolver.resolve('SSSSSSSSSS'), np.nan)
+        np.testing.assert_equal(self.resolver.resolve('S'), np.nan)
+        np.testing.assert_equal(self.resolver.resolve('SantaClaraWUTa;lksdjfl;kasdjaslkdj?'), np.nan)
+        np.testing.assert_equal(self.resolver.resolve(np.nan), np.nan)
+        np.testing.assert_equal(self.resolver.resolve(1.0), np.nan)
+
+    def test_resolve_unicode(self):
+        # county columns read back from parquet or feather
+        self.assertEqual(self.resolver.resolve(u'Alameda'), 'Alameda')
+        self.assertEqual(type(self.resolver.resolve(u'Alameda')), str)
+        self.assertEqual(self.resolver.resolve(u'Contra  Costa'), 'Contra Costa')
+        self.assertEqual(
+            self.resolver.get_new_aliases(pd.Series([u'Alamda']), pd.Series(['Alameda'])),
+            {'Alamda': 'Alameda'},
+        )
+
+    def test_cache(self):
+        for county in ['Alamda', 'Alpin', 'Alamda', 'Amadr']:
+            self.resolver.resolve(county)
+
+        # the least recently seen misspelling goes first
+        self.assertEqual(list(self.resolver.cache), ['Alamda', 'Amadr'])
+        self.assertNotIn('Alameda', self.resolver.cache)  # spelled right
+
+    def test_resolve_all(self):
+        counties = pd.Series(['Alameda', 'Alamda', np.nan, 'Alamda', 'Total'])
+        resolved = self.resolver.resolve_all(counties)
+
+        self.assertEqual(list(resolved[:2]), ['Alameda', 'Alameda'])
+        self.assertEqual(resolved.isnull().sum(), 2)
+        self.assertEqual(list(self.resolver.cache), ['Alamda', 'Total'])
+
+        resolved = self.resolver.resolve_all(pd.Series(['Grand Total', np.nan]))
+        self.assertEqual(resolved.dtype, object)
+
+    def test_aliases(self):
+        resolver = CountyResolver(aliases={'Alamda': 'Alameda'})
+        self.assertEqual(resolver.resolve('Alamda'), 'Alameda')
+        self.assertEqual(list(resolver.cache), [])  # looked up, not matched
+
+        raw = pd.Series(['Alameda', 'Alamda', 'Alpin', 'Total', np.nan, 'Alpin'])
+        aliases = resolver.get_new_aliases(raw, resolver.resolve_all(raw))
+        self.assertEqual(aliases, {'Alpin': 'Alpine'})  # Total isn't a county
+
+        resolver.learn(aliases)
+        self.assertEqual(resolver.resolve('Alpin'), 'Alpine')
+        self.assertEqual(list(resolver.cache), ['Total'])
+
+
+if __name__ == '__main__':
+    unittest.main()
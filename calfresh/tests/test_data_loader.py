@@ -11,3 +11,11 @@ class TestDataLoader(unittest.TestCase):
 
     def test_load(self):
         pass
+
+    def test_is_table_file(self):
+        loader = DataLoader()
+        self.assertTrue(loader.is_table_file('tbl_dfa296', 'tbl_dfa296.csv'))
+        self.assertTrue(loader.is_table_file(
+            'tbl_data_dashboard', 'tbl_data_dashboard_annual.csv'))
+        self.assertFalse(loader.is_table_file('tbl_dfa296', 'tbl_dfa296x.csv'))
+        self.assertFalse(loader.is_table_file('tbl_dfa358f', 'tbl_dfa358tot.csv'))
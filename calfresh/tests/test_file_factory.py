@@ -1,10 +1,15 @@
 
 from dateutil import parser
+from xlrd.xldate import xldate_as_datetime
+import os
 import unittest
 
 import numpy
+import pandas
 
 from file_factory import CF296Factory, FileFactory, initialize
+from state import CountyAliases
+import file_factory
 
 
 class TestFileFactories(unittest.TestCase):
@@ -113,6 +118,37 @@ class TestFileFactories(unittest.TestCase):
         self.file_factory.add_month('jan')
         self.assertEqual(self.file_factory.df['month'][0], 'JAN')
 
+    def test_add_excel_dates(self):
+        serials = [1.0, 59.0, 60.0, 61.0, 37256.0, 37257.0, 43190.5, 43190.0, 43190.0]
+        self.file_factory.df = pandas.DataFrame({'county': 'Yolo', 'date': serials})
+        self.file_factory.add_excel_dates('date')
+
+        dates = [xldate_as_datetime(serial, 0) for serial in serials]
+        self.assertEqual(
+            list(self.file_factory.df.columns), ['county', 'year', 'month', 'quarter']
+        )
+        self.assertEqual(
+            list(self.file_factory.df.year), [date.strftime('%Y') for date in dates]
+        )
+        self.assertEqual(
+            list(self.file_factory.df.month),
+            [date.strftime('%b').upper() for date in dates],
+        )
+
+        self.assertEqual(
+            list(self.file_factory.df.quarter),
+            [float((date.month - 1) // 3 + 1) for date in dates],
+        )
+
+        # add_quarter only moves it after the columns added since
+        self.file_factory.df['total'] = 0
+        self.file_factory.add_quarter()
+        self.assertEqual(self.file_factory.df.columns[-1], 'quarter')
+        self.assertEqual(self.file_factory.df.quarter[4], 4.0)
+
+        self.file_factory.df = pandas.DataFrame({'date': [43190.0, numpy.nan]})
+        self.assertRaises(ValueError, self.file_factory.add_excel_dates, 'date')
+
     def test_add_quarter(self):
         self.file_factory.df['month'] = 'JUNK'
         self.file_factory.add_quarter()
@@ -135,34 +171,44 @@ class TestFileFactories(unittest.TestCase):
         self.assertEqual(self.file_factory.df['good_decimals'].isnull().sum(), 56)
         self.assertEqual(self.file_factory.df['bad_decimals'].isnull().sum(), 61)
 
-    def test_get_valid_number(self):
-        valid_numbers = [1, 0.234, -1.123, '100', '1a2b3c']
-        invalid_numbers = ['all letters', None]
-
-        for number in valid_numbers:
-            self.assertEqual(type(self.file_factory._get_valid_number(number)), float)
-
-        for number in invalid_numbers:
-            numpy.testing.assert_equal(
-                self.file_factory._get_valid_number(number),
-                numpy.nan,
-            )
-
-    def test_convert_to_number(self):
-        self.assertEqual(
-            self.file_factory._convert_to_number('1a2b3c.4d'),
-            123.4
-        )
+    def test_check_numbers_none(self):
+        # parquet and feather hand back blanks in text columns as None
+        self.file_factory.df = pandas.DataFrame({
+            'county': ['Alameda', 'Alpine', 'Amador'],
+            'cases': [15733.0, None, '12'],
+        }, columns=['county', 'cases'])
+        self.file_factory.check_numbers()
 
         numpy.testing.assert_equal(
-            self.file_factory._convert_to_number(''),
-            numpy.nan,
+            list(self.file_factory.df['cases']), [15733.0, numpy.nan, 12.0]
         )
 
-        numpy.testing.assert_equal(
-            self.file_factory._convert_to_number(None),
-            numpy.nan,
+    def test_get_valid_numbers(self):
+        values = pandas.Series(
+            [1, 0.234, '-1.123', ' 1e3 ', '$1,234.5', '1a2b3c', '1.2.3', '', 'N/A', None],
+            dtype=object,
         )
+        numbers = self.file_factory._get_valid_numbers(values)
+
+        self.assertEqual(numbers.dtype, object)
+        expected = [1.0, 0.234, -1.123, 1000.0, 1234.5, 123.0,
+                    numpy.nan, numpy.nan, numpy.nan, numpy.nan]
+        for number, value in zip(numbers, expected):
+            self.assertEqual(type(number), float)
+            numpy.testing.assert_equal(number, value)
+
+        # columns of numbers come back as they were, as objects
+        numbers = self.file_factory._get_valid_numbers(pandas.Series([1, 0.234, -1.123]))
+        self.assertEqual(numbers.dtype, object)
+        self.assertEqual(list(numbers), [1.0, 0.234, -1.123])
+
+    def test_get_valid_numbers_stripped(self):
+        values = pandas.Series(['1a2b3c.4d', '-5a', '(7)', '.', 'a'])
+        numbers = self.file_factory._get_valid_numbers(values)
+
+        # the sign goes with the junk, like it always has
+        self.assertEqual(list(numbers[:3]), [123.4, 5.0, 7.0])
+        self.assertTrue(numbers[3:].isnull().all())
 
     def test_check_percents(self):
         self.file_factory.check_numbers(startCol=6, endCol=8)
@@ -178,14 +224,44 @@ class TestFileFactories(unittest.TestCase):
         self.assertEqual(self.file_factory.df['bad_percents'][1], -1.01)
         self.assertEqual(self.file_factory.df['bad_percents'][2], 0.015)
 
+    def test_check_percents_nulls(self):
+        self.file_factory.df = pandas.DataFrame({
+            'pct_reapps_churning': [150.0, '\N', numpy.nan, -0.5],
+            'pct_recerts_churning': [2.0, 0.5, 1.0, -300.0],
+        })
+        self.file_factory.check_percents(
+            ['pct_reapps_churning', 'pct_recerts_churning', 'not_a_column']
+        )
+
+        numpy.testing.assert_equal(
+            list(self.file_factory.df['pct_reapps_churning']),
+            [1.5, '\N', numpy.nan, -0.5],
+        )
+        self.assertEqual(
+            list(self.file_factory.df['pct_recerts_churning']),
+            [0.02, 0.5, 1.0, -3.0],
+        )
+
     def test_check_counties(self):
         good_counties = self.file_factory.df.columns[0]
 
-        # returns None because nothing bad happened
-        self.assertIsNone(self.file_factory.check_counties(col=0))
-        self.assertNotIn('Statewide', self.file_factory.df[good_counties].values)
-        self.assertEqual(len(self.file_factory.df[good_counties]), 59)
-        self.assertRaises(ValueError, self.file_factory.check_counties, col=1)
+        # keep the aliases out of the real state database
+        path = '/etc/calfresh/temp/test_state.db'
+        county_aliases = file_factory.county_aliases
+        file_factory.county_aliases = CountyAliases(path)
+        try:
+            # returns None because nothing bad happened
+            self.assertIsNone(self.file_factory.check_counties(col=0))
+            self.assertNotIn('Statewide', self.file_factory.df[good_counties].values)
+            self.assertEqual(len(self.file_factory.df[good_counties]), 59)
+            aliases = file_factory.county_aliases.get_all()
+            self.assertEqual(aliases['Alameda /a'], 'Alameda')
+            self.assertNotIn('Row_to_keep', aliases)
+            self.assertNotIn(None, aliases.values())
+            self.assertRaises(ValueError, self.file_factory.check_counties, col=1)
+        finally:
+            file_factory.county_aliases = county_aliases
+            os.remove(path)
 
     def test_trim_noncounty_rows(self):
         bad_counties = self.file_factory.df.columns[1]
@@ -208,48 +284,6 @@ class TestFileFactories(unittest.TestCase):
         self.file_factory._clean_county_names(bad_counties)
         self.assertEqual(self.file_factory.df[bad_counties].isnull().sum(), 6)
 
-    def test_get_nearest_spelled_counties(self):
-        too_few_letters = 'SantaCl'
-        too_many_letters = 'SantaClaraWUT?'
-        just_enough_letters = 'SantaClara/a'
-        exact_letters = 'SSSSSSSSSS'
-
-        too_few = self.file_factory._get_nearest_spelled_counties(too_few_letters)
-        too_many = self.file_factory._get_nearest_spelled_counties(too_many_letters)
-        just_enough = self.file_factory._get_nearest_spelled_counties(just_enough_letters)
-        exact = self.file_factory._get_nearest_spelled_counties(exact_letters)
-
-        self.assertNotIn('SantaClara', too_few)
-        self.assertNotIn('SantaClara', too_many)
-        self.assertIn('SantaClara', just_enough)
-        self.assertIn('SantaClara', exact)
-
-        self.assertEqual(just_enough['SantaClara'], 2L)
-        self.assertEqual(exact['SantaClara'], 9L)
-
-    def test_get_closest_spelled_county(self):
-        too_few_letters = 'S'
-        too_many_letters = 'SantaClaraWUTa;lksdjfl;kasdjaslkdj?'
-        exact_letters = 'SSSSSSSSSS'
-        just_enough_letters = 'SantaClara/a'
-
-        numpy.testing.assert_equal(
-            self.file_factory._get_closest_spelled_county(too_few_letters),
-            numpy.nan,
-        )
-        numpy.testing.assert_equal(
-            self.file_factory._get_closest_spelled_county(too_many_letters),
-            numpy.nan,
-        )
-        numpy.testing.assert_equal(
-            self.file_factory._get_closest_spelled_county(exact_letters),
-            numpy.nan,
-        )
-        self.assertEqual(
-            self.file_factory._get_closest_spelled_county(just_enough_letters),
-            'Santa Clara'
-        )
-
     def test_trim_bogus_columns(self):
         df_width = self.file_factory.df.shape[1]
         self.file_factory.trim_bogus_columns()
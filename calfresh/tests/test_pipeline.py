@@ -0,0 +1,138 @@
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from threading import Lock
+import unittest
+
+from catalog import FileCatalog
+from state import BuildCache
+from worker import Worker
+import pipeline
+from pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.lock = Lock()
+        self.changed = set(['tbl_cf296', 'tbl_dfa358f'])
+        self.failing = set()
+        self.converted = {}
+        test = self
+
+        self.root = '/etc/calfresh/temp/test_pipeline'
+        makedirs(join(self.root, 'data'))
+
+        class FakeCrawler(object):
+            def __init__(self, table, url):
+                self.table = table
+
+            def crawl(self):
+                test.log('crawl', self.table)
+                if self.table not in test.changed:
+                    return None
+
+                # a workbook the catalog hasn't seen, like a new month's
+                xlsx = join(test.root, 'data', self.table, 'xlsx')
+                makedirs(xlsx)
+                with open(join(xlsx, self.table + '-new.xlsx'), 'w') as f:
+                    f.write('workbook')
+                return self.table
+
+        self.broken = set()
+
+        class FakeWorker(object):
+            def __init__(self, table, catalog, results):
+                if table in test.broken:
+                    raise IOError('Could not open the state database')
+                self.table = table
+                self.worker = Worker(table, catalog, results)
+                self.worker.build_cache = BuildCache(join(test.root, 'state.db'))
+
+            def work(self):
+                test.log('work', self.table)
+                test.converted[self.table] = [
+                    item['filename'] for item, sheets in self.worker.get_changed_workbooks()
+                ]
+                if self.table in test.failing:
+                    raise ValueError('Failed to process ' + self.table)
+
+            def combine_358F_and_S(self):
+                test.log('work', self.table)
+
+        class FakeLoader(object):
+            def load(self, datapath, table):
+                test.log('load', table)
+
+        def start_pool():
+            test.log('start', 'pool')
+            return True
+
+        def stop_pool():
+            test.log('stop', 'pool')
+
+        self.originals = (pipeline.WebCrawler, pipeline.Worker, pipeline.DataLoader,
+                          pipeline.start_pool, pipeline.stop_pool)
+        pipeline.WebCrawler, pipeline.Worker, pipeline.DataLoader = \
+            FakeCrawler, FakeWorker, FakeLoader
+        pipeline.start_pool, pipeline.stop_pool = start_pool, stop_pool
+
+        table_url_map = dict(
+            (table, '') for table in ['tbl_cf296', 'tbl_dfa358f', 'tbl_dfa358s']
+        )
+        # built before the crawl, like the app's
+        catalog = FileCatalog(join(self.root, 'data'))
+        self.pipeline = Pipeline(table_url_map, catalog, None, crawlers=2, queue_size=1)
+
+    def tearDown(self):
+        (pipeline.WebCrawler, pipeline.Worker, pipeline.DataLoader,
+         pipeline.start_pool, pipeline.stop_pool) = self.originals
+        rmtree(self.root)
+
+    def log(self, stage, table):
+        with self.lock:
+            self.events.append((stage, table))
+
+    def test_run(self):
+        stats = self.pipeline.run()
+
+        loads = [table for stage, table in self.events if stage == 'load']
+        self.assertEqual(sorted(loads), ['tbl_cf296', 'tbl_dfa358f', 'tbl_dfa358tot'])
+        self.assertLess(loads.index('tbl_dfa358f'), loads.index('tbl_dfa358tot'))
+        self.assertEqual(stats['tbl_cf296']['load'][0], 'done')
+        self.assertEqual(stats['tbl_dfa358s']['crawl'][0], 'skipped')
+        self.assertNotIn('work', stats['tbl_dfa358s'])
+        self.assertEqual(stats['tbl_dfa358tot']['work'][0], 'done')
+
+        # the worker converts the workbooks downloaded during the run
+        self.assertEqual(self.converted, {
+            'tbl_cf296': ['tbl_cf296-new.xlsx'],
+            'tbl_dfa358f': ['tbl_dfa358f-new.xlsx'],
+        })
+
+        # the pool is forked before any stage thread starts
+        self.assertEqual(self.events[0], ('start', 'pool'))
+        self.assertEqual(self.events[-1], ('stop', 'pool'))
+
+    def test_run_failure(self):
+        self.failing.add('tbl_dfa358f')
+        stats = self.pipeline.run()
+
+        self.assertEqual(stats['tbl_dfa358f']['work'][0], 'failed')
+        self.assertNotIn('load', stats['tbl_dfa358f'])
+        self.assertNotIn('tbl_dfa358tot', stats)
+        self.assertEqual(stats['tbl_cf296']['load'][0], 'done')
+
+    def test_run_worker_broken(self):
+        self.broken.add('tbl_cf296')
+        stats = self.pipeline.run()
+
+        # the table fails instead of the worker thread, so the others finish
+        self.assertEqual(stats['tbl_cf296']['work'][0], 'failed')
+        self.assertNotIn('load', stats['tbl_cf296'])
+        self.assertEqual(stats['tbl_dfa358tot']['load'][0], 'done')
+
+
+if __name__ == '__main__':
+    unittest.main()
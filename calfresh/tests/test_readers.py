@@ -0,0 +1,69 @@
+from datetime import datetime
+from os import remove
+import unittest
+
+from openpyxl import Workbook
+from openpyxl.styles import Font
+from xlrd import open_workbook, xldate_from_datetime_tuple
+
+from readers import XlsxReader, open_reader
+
+
+class TestXlsxReader(unittest.TestCase):
+
+    def setUp(self):
+        self.path = '/etc/calfresh/temp/test_readers.xlsx'
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = 'Data'
+        sheet.append([u'County', u'Date', u'Cases', u'Open'])
+        sheet.append([u'Alameda', datetime(2017, 7, 1), 15733, True])
+        sheet.append([u'Alpine', datetime(2017, 8, 1), 17.5, None])
+        sheet['F5'].font = Font(bold=True)  # formatted, but empty
+        sheet.merge_cells('A7:B7')
+        workbook.create_sheet('Release Summary').append([u'Released'])
+        workbook.save(self.path)
+
+        self.reader = XlsxReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        remove(self.path)
+
+    def test_open_reader(self):
+        reader = open_reader(self.path)
+        self.assertIsInstance(reader, XlsxReader)
+        reader.close()
+
+    def test_sheet_names(self):
+        self.assertEqual(self.reader.sheet_names(), ['Data', 'Release Summary'])
+
+    def test_rows(self):
+        workbook = open_workbook(self.path)
+        for name in workbook.sheet_names():
+            sheet = workbook.sheet_by_name(name)
+            expected = [sheet.row_values(row) for row in xrange(sheet.nrows)]
+            rows = list(self.reader.rows(name))
+
+            self.assertEqual(rows, expected)
+            for row, values in zip(rows, expected):
+                self.assertEqual(map(type, row), map(type, values))
+
+    def test_get_value_date(self):
+        # openpyxl 2.6 reads date formatted cells as dates instead of numbers
+        class DateCell(object):
+            data_type = 'd'
+            value = datetime(2017, 7, 1, 12)
+
+        serial = xldate_from_datetime_tuple((2017, 7, 1, 12, 0, 0), 0)
+        self.assertEqual(self.reader.get_value(DateCell()), serial)
+        self.assertEqual(type(self.reader.get_value(DateCell())), float)
+
+    def test_get_shape(self):
+        sheet = self.reader.workbook['Data']
+        self.assertEqual(self.reader.get_shape(sheet), (7, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
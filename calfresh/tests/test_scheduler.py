@@ -0,0 +1,118 @@
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from threading import Lock
+import time
+import unittest
+
+from catalog import FileCatalog
+from scheduler import DONE, FAILED, SKIPPED, Scheduler, Skip
+from state import BuildCache
+from worker import Worker
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(limits={'work': 1})
+        self.order = []
+        self.lock = Lock()
+
+    def job(self, name, seconds=0, result=None):
+        def run():
+            time.sleep(seconds)
+            with self.lock:
+                self.order.append(name)
+            return result
+        return run
+
+    def test_add(self):
+        self.scheduler.add('crawl', self.job('crawl'))
+        with self.assertRaises(ValueError):
+            self.scheduler.add('crawl', self.job('crawl'))
+        with self.assertRaises(ValueError):
+            self.scheduler.add('load', self.job('load'), ['work'])
+
+    def test_run(self):
+        self.scheduler.add('crawl', self.job('crawl', result='tbl_cf296'))
+        self.scheduler.add('work', self.job('work'), ['crawl'])
+        self.scheduler.add('load', self.job('load'), ['work'])
+
+        nodes = self.scheduler.run()
+        self.assertEqual(self.order, ['crawl', 'work', 'load'])
+        self.assertEqual([node.status for node in nodes.values()], [DONE] * 3)
+        self.assertEqual(nodes['crawl'].result, 'tbl_cf296')
+        self.assertIsNotNone(nodes['load'].elapsed)
+
+    def test_run_concurrently(self):
+        self.scheduler.add('crawl:slow', self.job('crawl:slow', seconds=0.2))
+        self.scheduler.add('crawl:fast', self.job('crawl:fast'))
+        self.scheduler.add('work:fast', self.job('work:fast'), ['crawl:fast'])
+
+        self.scheduler.run()
+        self.assertEqual(self.order, ['crawl:fast', 'work:fast', 'crawl:slow'])
+
+    def test_run_limits(self):
+        for name in ['work:a', 'work:b']:
+            self.scheduler.add(name, self.job(name + ':start', seconds=0.1), kind='work')
+        self.scheduler.run()
+
+        a, b = self.scheduler.nodes['work:a'], self.scheduler.nodes['work:b']
+        self.assertTrue(a.finished <= b.started or b.finished <= a.started)
+
+    def test_skip(self):
+        def crawl():
+            raise Skip('no new data')
+
+        self.scheduler.add('crawl:a', crawl)
+        self.scheduler.add('work:a', self.job('work:a'), ['crawl:a'])
+        self.scheduler.add('crawl:b', self.job('crawl:b'))
+        self.scheduler.add('work:b', self.job('work:b'), ['crawl:b'])
+        self.scheduler.add('work:total', self.job('work:total'), ['work:a', 'work:b'])
+
+        nodes = self.scheduler.run()
+        self.assertEqual(nodes['crawl:a'].status, SKIPPED)
+        self.assertEqual(nodes['work:a'].status, SKIPPED)
+        self.assertEqual(nodes['work:total'].status, DONE)  # work:b did its job
+
+    def test_failure(self):
+        def work():
+            raise ValueError('Failed to process DFA256FY17-18-Data.csv')
+
+        self.scheduler.add('work', work)
+        self.scheduler.add('load', self.job('load'), ['work'])
+        self.scheduler.add('other', self.job('other'))
+
+        nodes = self.scheduler.run()
+        self.assertEqual(nodes['work'].status, FAILED)
+        self.assertIn('ValueError', nodes['work'].error)
+        self.assertEqual(nodes['load'].status, SKIPPED)
+        self.assertEqual(nodes['other'].status, DONE)
+
+    def test_work_new_download(self):
+        root = '/etc/calfresh/temp/test_scheduler'
+        makedirs(join(root, 'data', 'tbl_cf296', 'xlsx'))
+        self.addCleanup(rmtree, root)
+
+        # built before the crawl, like the app's
+        catalog = FileCatalog(join(root, 'data'))
+
+        def crawl():
+            path = join(root, 'data', 'tbl_cf296', 'xlsx', 'CF296FY18-19.xlsx')
+            with open(path, 'w') as f:
+                f.write('workbook')
+
+        def work():
+            worker = Worker('tbl_cf296', catalog)
+            worker.build_cache = BuildCache(join(root, 'state.db'))
+            return [item['filename'] for item, sheets in worker.get_changed_workbooks()]
+
+        self.scheduler.add('crawl', crawl)
+        self.scheduler.add('work', work, ['crawl'])
+
+        nodes = self.scheduler.run()
+        self.assertEqual(nodes['work'].result, ['CF296FY18-19.xlsx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import csv
+import os
+import unittest
+
+from state import BuildCache, CountyAliases, FileManifest, LinkIndex, hash_file
+
+
+class TestHashFile(unittest.TestCase):
+
+    def test_hash_file(self):
+        path = '/etc/calfresh/temp/test_hash_file'
+        with open(path, 'wb') as f:
+            f.write(b'calfresh')
+
+        sha256, size = hash_file(path, chunk_size=3)
+        os.remove(path)
+
+        self.assertEqual(
+            sha256,
+            'b85be08cc888f14c78a745447de6d0a96daf4dda27d660222561b3288712e8d9',
+        )
+        self.assertEqual(size, 8)
+
+
+class TestFileManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = '/etc/calfresh/temp/test_state.db'
+        self.manifest = FileManifest(self.path)
+        self.url = '/9/DSSDB/DataTables/DFA256FY17-18.xlsx?ver=2018-06-08-125617-450'
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_get(self):
+        self.assertIsNone(self.manifest.get(self.url))
+
+    def test_has_content(self):
+        self.assertFalse(self.manifest.has_content('tbl_dfa256', 'abc123'))
+
+        self.manifest.record(self.url, 'tbl_dfa256', 'DFA256FY17-18.xlsx', 'abc123', 10)
+        self.assertTrue(self.manifest.has_content('tbl_dfa256', 'abc123'))
+        self.assertFalse(self.manifest.has_content('tbl_cf296', 'abc123'))
+
+    def test_record(self):
+        self.manifest.record(
+            self.url, 'tbl_dfa256', 'DFA256FY17-18.xlsx', 'abc123', 10, etag='"v1"',
+        )
+        self.manifest.record(
+            self.url, 'tbl_dfa256', 'DFA256FY17-18.xlsx', 'def456', 12, etag='"v2"',
+        )
+
+        entry = self.manifest.get(self.url)
+        self.assertEqual(entry['sha256'], 'def456')
+        self.assertEqual(entry['size'], 12)
+        self.assertEqual(entry['etag'], '"v2"')
+        self.assertIsNone(entry['last_modified'])
+        self.assertFalse(self.manifest.has_content('tbl_dfa256', 'abc123'))
+
+    def test_changed(self):
+        self.assertEqual(self.manifest.changed('tbl_dfa256'), {})
+
+        self.manifest.record(self.url, 'tbl_dfa256', 'DFA256FY17-18.xlsx', 'abc123', 10)
+        changed = self.manifest.changed('tbl_dfa256')['DFA256FY17-18.xlsx']
+
+        # the same bytes fetched again
+        self.manifest.record(
+            self.url, 'tbl_dfa256', 'DFA256FY17-18.xlsx', 'abc123', 10, changed=False,
+        )
+        self.assertEqual(self.manifest.changed('tbl_dfa256'), {'DFA256FY17-18.xlsx': changed})
+        self.assertNotEqual(self.manifest.get(self.url)['fetched'], changed)
+
+
+class TestLinkIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.path = '/etc/calfresh/temp/test_state.db'
+        self.index = LinkIndex(self.path)
+        self.urls = [
+            '/9/DSSDB/DataTables/DFA256FY16-17.xlsx',
+            '/9/DSSDB/DataTables/DFA256FY17-18.xlsx',
+        ]
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_urls(self):
+        self.assertEqual(self.index.urls('tbl_dfa256'), set())
+
+    def test_record(self):
+        self.index.record('tbl_dfa256', self.urls[:1])
+        self.index.record('tbl_dfa256', self.urls)
+
+        self.assertEqual(self.index.urls('tbl_dfa256'), set(self.urls))
+        self.assertEqual(self.index.urls('tbl_cf296'), set())
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = '/etc/calfresh/temp/test_state.db'
+        self.cache = BuildCache(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get('tbl_dfa256', 'DFA256FY17-18.xlsx'))
+
+    def test_record(self):
+        outputs = ['DFA256FY17-18-Data.csv']
+        self.cache.record('tbl_dfa256', 'DFA256FY17-18.xlsx', 'abc123', 1, outputs)
+
+        build = self.cache.get('tbl_dfa256', 'DFA256FY17-18.xlsx')
+        self.assertEqual(build['sha256'], 'abc123')
+        self.assertEqual(build['version'], 1)
+        self.assertEqual(build['outputs'], outputs)
+
+
+class TestCountyAliases(unittest.TestCase):
+
+    def setUp(self):
+        self.path = '/etc/calfresh/temp/test_state.db'
+        self.aliases = CountyAliases(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_get_all(self):
+        self.assertEqual(self.aliases.get_all(), {})
+
+    def test_record(self):
+        self.aliases.record({'Alamda': 'Alameda'}, 'DFA256FY16-17-Data.csv')
+        self.aliases.record(
+            {'Alamda': 'Alameda', 'Total': float('nan'), '\xff': 'Yolo'},
+            'DFA256FY17-18-Data.csv',
+        )
+
+        aliases = self.aliases.get_all()
+        self.assertEqual(aliases, {'Alamda': 'Alameda'})
+        self.assertEqual(type(aliases.keys()[0]), str)
+        self.assertEqual(type(aliases['Alamda']), str)
+
+    def test_get_all_ignores_nulls(self):
+        # older runs saved the names that aren't a county as NULL
+        with self.aliases._connect() as conn:
+            conn.execute(
+                'INSERT INTO county_aliases VALUES (?, NULL, ?, ?)',
+                (u'Report Run on 09SEP2016', 'DFA256FY16-17-Data.csv', '2016-09-09'),
+            )
+        self.aliases.record({'Yoloo': 'Yolo'}, 'DFA256FY17-18-Data.csv')
+
+        self.assertEqual(self.aliases.get_all(), {'Yoloo': 'Yolo'})
+
+    def test_export(self):
+        self.aliases.record({'Alamda': 'Alameda'}, 'DFA256FY16-17-Data.csv')
+        self.aliases.record({'Yoloo': 'Yolo', 'Total': None}, 'DFA256FY17-18-Data.csv')
+
+        path = '/etc/calfresh/temp/test_county_aliases.csv'
+        self.assertEqual(self.aliases.export(path), 2)
+        with open(path) as f:
+            rows = list(csv.reader(f))
+        os.remove(path)
+
+        self.assertEqual(rows[0], ['alias', 'county', 'filename', 'first_seen'])
+        self.assertEqual(rows[1][:3], ['Alamda', 'Alameda', 'DFA256FY16-17-Data.csv'])
+        self.assertEqual(rows[2][:3], ['Yoloo', 'Yolo', 'DFA256FY17-18-Data.csv'])
+        self.assertEqual(len(rows), 3)
@@ -0,0 +1,67 @@
+from os import remove
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from storage import CsvStorage, FeatherStorage, get_storage, storage_for, to_storable
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'county': ['Alameda', 'Alpine', 'Amador'],
+            'cases': [15733.0, np.nan, 17.5],
+            'households': [0.123456789012345, '\N', np.nan],
+        }, columns=['county', 'cases', 'households'])
+
+    def test_names(self):
+        storage = CsvStorage()
+        storage.extension = '.feather'
+        self.assertEqual(storage.stored_name('DFA256FY17-18-Data.csv'), 'DFA256FY17-18-Data.feather')
+        self.assertEqual(storage.csv_name('DFA256FY17-18-Data.feather'), 'DFA256FY17-18-Data.csv')
+        self.assertTrue(storage.is_stored('DFA256FY17-18-Data.feather'))
+        self.assertFalse(storage.is_stored('DFA256FY17-18-Data.csv'))
+
+    def test_to_storable(self):
+        df = to_storable(self.df.set_index('county'))
+        self.assertEqual(list(df.columns), ['cases', 'households'])
+        self.assertEqual(df.cases.dtype, np.float64)
+        # the text to_csv would write, since the column can't hold floats and text
+        self.assertEqual(list(df.households[:2]), ['0.123456789012345', '\N'])
+        self.assertTrue(np.isnan(df.households[2]))
+
+    def test_csv(self):
+        path = '/etc/calfresh/temp/test_storage.csv'
+        storage = CsvStorage()
+        storage.write(self.df, path)
+        try:
+            df = storage.read(path)[['county', 'cases']]
+            pd.util.testing.assert_frame_equal(df, self.df[['county', 'cases']])
+            self.assertIsInstance(storage_for(path), CsvStorage)
+        finally:
+            remove(path)
+
+    def test_feather(self):
+        try:
+            storage = FeatherStorage()
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+
+        path = '/etc/calfresh/temp/test_storage.feather'
+        storage.write(self.df, path)
+        try:
+            df = storage.read(path)[['county', 'cases']]
+            pd.util.testing.assert_frame_equal(df, self.df[['county', 'cases']])
+        finally:
+            remove(path)
+
+    def test_get_storage(self):
+        self.assertIsInstance(get_storage('csv'), CsvStorage)
+        with self.assertRaises(ValueError):
+            get_storage('xlsx')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,241 @@
 
 import datetime
+import errno
+import hashlib
 import os
+import time
 import unittest
 
-from bs4 import BeautifulSoup
-
 from constants import table_url_map
-from web_crawler import WebCrawler, PageParser
+from state import FileManifest, LinkIndex
+import web_crawler
+from web_crawler import (
+    PageParser,
+    RateLimiter,
+    ValidatorCache,
+    WebCrawler,
+    _get_timeout,
+    extract_links,
+)
+
+
+class TestGetTimeout(unittest.TestCase):
+
+    def test_get_timeout(self):
+        self.assertEqual(_get_timeout(table_url_map['tbl_dfa256']), (10.0, 120.0))
+        self.assertEqual(_get_timeout('http://example.com/page'), (10.0, 60.0))
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_consume(self):
+        started = time.time()
+        RateLimiter(0).consume(10 ** 9)
+        self.assertLess(time.time() - started, 0.1)
+
+        limiter = RateLimiter(1000)
+        started = time.time()
+        for i in range(3):
+            limiter.consume(250)
+        # the first chunk goes right away, the next two wait their turn
+        self.assertGreaterEqual(time.time() - started, 0.45)
+
+
+class TestValidatorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = '/etc/calfresh/temp/test_validators.json'
+        self.cache = ValidatorCache(self.path)
+        self.url = table_url_map['tbl_dfa256']
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_headers(self):
+        self.assertEqual(self.cache.headers(self.url), {})
+
+        self.cache.update(self.url, {'ETag': '"abc"'})
+        self.assertEqual(self.cache.headers(self.url), {'If-None-Match': '"abc"'})
+
+    def test_update(self):
+        last_modified = 'Fri, 08 Jun 2018 12:56:17 GMT'
+        self.cache.update(self.url, {'ETag': '"abc"', 'Last-Modified': last_modified})
+
+        reloaded = ValidatorCache(self.path)
+        self.assertEqual(reloaded.headers(self.url), {
+            'If-None-Match': '"abc"',
+            'If-Modified-Since': last_modified,
+        })
+
+        # a response without validators forgets the old ones
+        self.cache.update(self.url, {})
+        self.assertEqual(ValidatorCache(self.path).headers(self.url), {})
+
+
+class FakeResponse(object):
+    """Stands in for a streamed requests response"""
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {'Content-Length': str(len(content))}
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    """Hands out the responses in order, keeping the headers of each request"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+class TestStreamToFile(unittest.TestCase):
+
+    def setUp(self):
+        self.crawler = WebCrawler(
+            table='tbl_dfa256',
+            url=table_url_map['tbl_dfa256'],
+        )
+        self.url = '/9/DSSDB/DataTables/DFA256FY17-18.xlsx'
+        self.part_path = '/etc/calfresh/temp/test_stream_to_file.part'
+        self.session = web_crawler.session
+        self.validator_cache = web_crawler.validator_cache
+        web_crawler.validator_cache = ValidatorCache('/etc/calfresh/temp/test_validators.json')
+
+    def tearDown(self):
+        web_crawler.session = self.session
+        if os.path.exists(web_crawler.validator_cache.path):
+            os.remove(web_crawler.validator_cache.path)
+        web_crawler.validator_cache = self.validator_cache
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    def write_part(self, content):
+        with open(self.part_path, 'wb') as f:
+            f.write(content)
+
+    def test_download(self):
+        web_crawler.session = FakeSession(FakeResponse(200, b'calfresh', {
+            'Content-Length': '8', 'ETag': '"v1"',
+        }))
+        headers, received = self.crawler._stream_to_file(self.url, self.part_path)
+
+        self.assertEqual(received, 8)
+        self.assertEqual(headers['ETag'], '"v1"')
+        # the url's validators wait until the file is in place
+        self.assertEqual(web_crawler.validator_cache.headers(self.url), {})
+        self.assertEqual(
+            web_crawler.validator_cache.headers(self.part_path), {'If-None-Match': '"v1"'}
+        )
+        # compressed responses would be counted after decoding
+        self.assertEqual(web_crawler.session.requests[0], {'Accept-Encoding': 'identity'})
+
+    def test_resume(self):
+        web_crawler.validator_cache.update(self.part_path, {'ETag': '"v1"'})
+        self.write_part(b'cal')
+        web_crawler.session = FakeSession(FakeResponse(206, b'fresh'))
+        self.crawler._stream_to_file(self.url, self.part_path)
+
+        request = web_crawler.session.requests[0]
+        self.assertEqual(request['Range'], 'bytes=3-')
+        self.assertEqual(request['If-Range'], '"v1"')
+        with open(self.part_path, 'rb') as f:
+            self.assertEqual(f.read(), b'calfresh')
+
+    def test_resume_progress(self):
+        web_crawler.session = FakeSession(
+            FakeResponse(200, b'cal', {'Content-Length': '8', 'ETag': '"v1"'}),
+            FakeResponse(206, b'fresh'),
+        )
+        progress = {'received': 0}
+        self.assertRaises(
+            IOError, self.crawler._stream_to_file, self.url, self.part_path, None, progress,
+        )
+        self.crawler._stream_to_file(self.url, self.part_path, None, progress)
+
+        # the interrupted attempt's bytes count too
+        self.assertEqual(progress['received'], 8)
+
+    def test_resume_without_validator(self):
+        self.write_part(b'old')
+        web_crawler.session = FakeSession(FakeResponse(200, b'calfresh'))
+        self.crawler._stream_to_file(self.url, self.part_path)
+
+        self.assertNotIn('Range', web_crawler.session.requests[0])
+        with open(self.part_path, 'rb') as f:
+            self.assertEqual(f.read(), b'calfresh')
+
+    def test_download_lost_file(self):
+        manifest = web_crawler.manifest
+        web_crawler.manifest = FileManifest('/etc/calfresh/temp/test_state.db')
+        filepath = '/etc/calfresh/temp/DFA256FY17-18.xlsx'
+        try:
+            # downloaded before, but deleted from the table's directory since
+            web_crawler.manifest.record(
+                self.url, 'tbl_dfa256', 'DFA256FY17-18.xlsx',
+                hashlib.sha256(b'calfresh').hexdigest(), 8, etag='"v1"',
+            )
+            web_crawler.session = FakeSession(FakeResponse(200, b'calfresh'))
+
+            self.assertTrue(self.crawler._download_file(self.url, filepath))
+            self.assertNotIn('If-None-Match', web_crawler.session.requests[0])
+            with open(filepath, 'rb') as f:
+                self.assertEqual(f.read(), b'calfresh')
+        finally:
+            os.remove(web_crawler.manifest.path)
+            web_crawler.manifest = manifest
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def test_move_into_place(self):
+        self.write_part(b'calfresh')
+        filepath = '/etc/calfresh/temp/test_move_into_place.xlsx'
+
+        # the temp directory on another filesystem
+        rename = os.rename
+
+        def cross_device(src, dst):
+            os.rename = rename
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        os.rename = cross_device
+        try:
+            web_crawler._move_into_place(self.part_path, filepath)
+        finally:
+            os.rename = rename
+
+        self.assertFalse(os.path.exists(self.part_path))
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), b'calfresh')
+        os.remove(filepath)
+
+    def test_clean_up_parts(self):
+        self.write_part(b'cal')
+        web_crawler.validator_cache.update(self.part_path, {'ETag': '"v1"'})
+        three_days_ago = time.time() - 3 * 24 * 60 * 60
+        os.utime(self.part_path, (three_days_ago, three_days_ago))
+
+        WebCrawler.clean_up()
+        self.assertFalse(os.path.exists(self.part_path))
+        self.assertEqual(web_crawler.validator_cache.headers(self.part_path), {})
+
+    def test_incomplete(self):
+        web_crawler.session = FakeSession(FakeResponse(200, b'cal', {'Content-Length': '8'}))
+        self.assertRaises(IOError, self.crawler._stream_to_file, self.url, self.part_path)
 
 
 class TestWebCrawler(unittest.TestCase):
@@ -20,6 +249,26 @@ class TestWebCrawler(unittest.TestCase):
     def test_crawl(self):
         pass
 
+    def test_crawl_page_not_modified(self):
+        url = '/9/DSSDB/DataTables/DFA256FY17-18.xlsx'
+        originals = (web_crawler.session, web_crawler.link_index, web_crawler.validator_cache)
+        web_crawler.session = FakeSession(FakeResponse(304, b''))
+        web_crawler.link_index = LinkIndex('/etc/calfresh/temp/test_state.db')
+        web_crawler.link_index.record(self.crawler.table, [url])
+        web_crawler.validator_cache = ValidatorCache('/etc/calfresh/temp/test_validators.json')
+        try:
+            # the file at the known url was re-published with new bytes
+            downloaded = []
+            self.crawler._download_new_files = \
+                lambda paths: downloaded.extend(paths) or ['DFA256FY17-18.xlsx']
+
+            self.assertEqual(self.crawler.crawl(), self.crawler.table)
+            self.assertEqual(downloaded, [url])
+        finally:
+            os.remove(web_crawler.link_index.path)
+            (web_crawler.session, web_crawler.link_index,
+             web_crawler.validator_cache) = originals
+
     def test_get_new_page(self):
         filepath = os.path.join(
             '/etc/calfresh/temp',
@@ -78,6 +327,18 @@ class TestWebCrawler(unittest.TestCase):
             self.assertNotIn('junk2_' + two_days_ago, files)
 
 
+class TestExtractLinks(unittest.TestCase):
+
+    def test_extract_links(self):
+        page = '/etc/calfresh/calfresh/tests/test_today_page.html'
+        links = extract_links(page)
+
+        self.assertIn('NEW/Portals/9/DSSDB/DataTables/DFA256FY17-18.xlsx', links)
+        self.assertIn('OLD/Portals/9/DSSDB/DataTables/DFA256FY16-17.xlsx', links)
+        # the same snapshot is only parsed once
+        self.assertIs(extract_links(page), links)
+
+
 class TestPageParser(unittest.TestCase):
 
     def setUp(self):
@@ -88,15 +349,20 @@ class TestPageParser(unittest.TestCase):
         )
 
     def test_parse(self):
-        self.assertIsNone(self.parser.new_soup)
-        self.assertIsNone(self.parser.old_soup)
+        self.assertIsNone(self.parser.new_links)
+        self.assertIsNone(self.parser.old_links)
         self.assertEqual(len(self.parser.updated_paths), 0)
 
         self.parser.parse()
 
-        bs = BeautifulSoup()
-        self.assertEqual(type(self.parser.new_soup), type(bs))
-        self.assertEqual(type(self.parser.old_soup), type(bs))
+        self.assertIn(
+            'NEW/Portals/9/DSSDB/DataTables/DFA256FY17-18.xlsx',
+            self.parser.new_links,
+        )
+        self.assertIn(
+            'OLD/Portals/9/DSSDB/DataTables/DFA256FY16-17.xlsx',
+            self.parser.old_links,
+        )
         self.assertEqual(len(self.parser.updated_paths), 1)
         self.assertIn(
             'NEW/Portals/9/DSSDB/DataTables/DFA256FY17-18.xlsx',
@@ -108,13 +374,18 @@ class TestPageParser(unittest.TestCase):
         )
 
     def test_load_page_content(self):
-        self.assertIsNone(self.parser.new_soup)
-        self.assertIsNone(self.parser.old_soup)
+        self.assertIsNone(self.parser.new_links)
+        self.assertIsNone(self.parser.old_links)
 
         self.parser._load_page_content()
-        bs = BeautifulSoup()
-        self.assertEqual(type(self.parser.new_soup), type(bs))
-        self.assertEqual(type(self.parser.old_soup), type(bs))
+        self.assertIn(
+            'NEW/Portals/9/DSSDB/DataTables/DFA256FY17-18.xlsx',
+            self.parser.new_links,
+        )
+        self.assertIn(
+            'OLD/Portals/9/DSSDB/DataTables/DFA256FY16-17.xlsx',
+            self.parser.old_links,
+        )
 
     def test_get_all_xls_urls(self):
         good_url1 = '/9/DSSDB/DataTables/DFA256FY17-18.xlsx?ver=2018-06-08-125617-450'
@@ -148,3 +419,40 @@ class TestPageParser(unittest.TestCase):
             'OLD/Portals/9/DSSDB/DataTables/DFA256FY16-17.xlsx',
             self.parser.updated_paths,
         )
+
+
+class TestPageParserWithLinkIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.path = '/etc/calfresh/temp/test_state.db'
+        self.link_index = LinkIndex(self.path)
+        self.parser = PageParser(
+            table='tbl_dfa256',
+            new_page='/etc/calfresh/calfresh/tests/test_today_page.html',
+            old_page='/etc/calfresh/calfresh/tests/test_yesterday_page.html',
+            link_index=self.link_index,
+        )
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_parse(self):
+        # an empty index is seeded from yesterday's page
+        self.parser.parse()
+        self.assertIsNotNone(self.parser.old_links)
+        self.assertEqual(
+            self.parser.updated_paths,
+            ['NEW/Portals/9/DSSDB/DataTables/DFA256FY17-18.xlsx'],
+        )
+        self.link_index.record('tbl_dfa256', self.parser.all_paths)
+
+        # after that yesterday's page isn't needed, even if it's missing
+        parser = PageParser(
+            table='tbl_dfa256',
+            new_page='/etc/calfresh/calfresh/tests/test_today_page.html',
+            old_page='/etc/calfresh/temp/missing_page',
+            link_index=self.link_index,
+        )
+        parser.parse()
+        self.assertIsNone(parser.old_links)
+        self.assertEqual(parser.updated_paths, [])
@@ -1,7 +1,33 @@
-
+from os import getpid, listdir, makedirs, utime
+from os.path import abspath, basename, dirname, exists, join
+from shutil import copy, rmtree
+from threading import Event, Thread
 import unittest
 
-from worker import Worker
+from openpyxl import Workbook
+import numpy as np
+import pandas as pd
+
+from catalog import FileCatalog
+from file_factory import FACTORY_VERSION
+from state import BuildCache, CountyAliases, FileManifest, hash_file
+from storage import storage_for
+import file_factory
+import worker
+from worker import (
+    MergeResults,
+    Worker,
+    get_csv_filename,
+    is_junk_file,
+    merge_frames,
+    run_in_processes,
+    sheet_to_frame,
+    write_sheet,
+)
+
+
+def get_pid(job):
+    return getpid()
 
 
 class TestWorker(unittest.TestCase):
@@ -21,9 +47,6 @@ class TestWorker(unittest.TestCase):
     def test_get_excel_files(self):
         pass
 
-    def test_convert_excel_file(self):
-        pass
-
     def test_strip_filename(self):
         pass
 
@@ -33,11 +56,409 @@ class TestWorker(unittest.TestCase):
     def test_remove_junk_files(self):
         pass
 
+    def test_run_in_processes(self):
+        worker.start_pool(processes=2)
+        try:
+            pids = run_in_processes(get_pid, range(4), processes=2)
+        finally:
+            worker.stop_pool()
+        self.assertNotIn(getpid(), pids)
+        self.assertIsNone(worker._pool)
+
+        # with no pool started, a threaded process doesn't fork one
+        done = Event()
+        thread = Thread(target=done.wait)
+        thread.start()
+        try:
+            pids = run_in_processes(get_pid, range(4), processes=2)
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual(pids, [getpid()] * 4)
+
+    def test_is_junk_file(self):
+        self.assertTrue(is_junk_file('tbl_cf296', 'CF296FY17-18-Statewide.csv'))
+        self.assertTrue(is_junk_file('tbl_dfa256', 'DFA256FY17-18-DataDictionary.csv'))
+        self.assertTrue(is_junk_file('tbl_unknown', 'DataDictionary-Sheet1.csv'))
+        self.assertFalse(is_junk_file('tbl_cf296', 'CF296FY17-18-Data.csv'))
+        self.assertFalse(is_junk_file('tbl_cf15', 'CF15-DataDictionary.csv'))
+        self.assertFalse(is_junk_file('tbl_churn_data', 'CY2017_Churn-Statewide.csv'))
+
+    def test_get_csv_filename(self):
+        item = {'filename': 'DFA256FY17-18.xlsx'}
+        self.assertEqual(get_csv_filename(item, 'Data'), 'DFA256FY17-18-Data.csv')
+
+    def test_sheet_to_frame(self):
+        rows = [
+            [u'County', u'', u'Cases', u'Cases'],
+            [u'Alameda', u'', 15733.0, u'N/A'],
+            [u'San Bernardino', 2.5, 1635.0, 12.0],
+            [u'Total \u2013 Statewide', u'', u'', 3.0],
+        ]
+        csv_path = '/etc/calfresh/temp/test_sheet_to_frame.csv'
+        write_sheet(rows, csv_path)
+
+        df = sheet_to_frame(rows)
+        self.assertEqual(list(df.columns), ['County', 'Unnamed: 1', 'Cases', 'Cases.1'])
+        pd.util.testing.assert_frame_equal(df, pd.read_csv(csv_path))
+
+    def test_merge_frames(self):
+        keys = ['county', 'fulldate']
+        items_1_14 = pd.DataFrame({
+            'county': ['Alameda', 'Alpine'],
+            'registrants': ['1417', '3'],
+            'fulldate': ['2016-01-01', '2016-01-01'],
+        }, columns=['county', 'registrants', 'fulldate'])
+        items_15_29 = pd.DataFrame({
+            'county': ['Alameda', 'Alpine'],
+            'abawds': ['12', '0'],
+            'fulldate': ['2016-01-01', '2016-01-01'],
+        }, columns=['county', 'abawds', 'fulldate'])
+        revised = pd.DataFrame({
+            'county': ['Alameda', 'Alpine'],
+            'registrants': ['1420', np.nan],
+            'fulldate': ['2016-01-01', '2016-01-01'],
+        }, columns=['county', 'registrants', 'fulldate'])
+
+        df = merge_frames([items_1_14, items_15_29, revised], keys)
+        self.assertEqual(list(df.columns), ['county', 'registrants', 'fulldate', 'abawds'])
+        self.assertEqual(df.values.tolist(), [
+            ['Alameda', '1420', '2016-01-01', '12'],
+            ['Alpine', '3', '2016-01-01', '0'],
+        ])
+
+    def test_merge_frames_nulls(self):
+        keys = ['county', 'fulldate']
+        old = pd.DataFrame({
+            'county': ['Alameda', 'Alpine', np.nan],
+            'fulldate': ['2016-01-01', '2016-01-01', '2016-01-01'],
+            'cases': ['1417', '\\N', '5'],
+            'quarter': ['1.0', np.nan, '1.0'],
+        }, columns=['county', 'fulldate', 'cases', 'quarter'])
+        new = pd.DataFrame({
+            'county': ['Alameda', 'Alpine'],
+            'fulldate': ['2016-01-01', '2016-01-01'],
+            'cases': ['\\N', '\\N'],
+        }, columns=['county', 'fulldate', 'cases'])
+
+        df = merge_frames([old, new], keys)
+        # a null doesn't replace a value, the row without a county is dropped
+        self.assertEqual(df.fillna('').values.tolist(), [
+            ['Alameda', '2016-01-01', '1417', '1.0'],
+            ['Alpine', '2016-01-01', '\\N', ''],
+        ])
+
+    def test_merge_results(self):
+        results = MergeResults()
+        df = pd.DataFrame({'county': ['Alameda'], 'fulldate': ['2017-07-01']})
+        results.add('tbl_dfa358f', df)
+
+        self.assertIs(results.get('tbl_dfa358f'), df)
+        self.assertIsNone(results.get('tbl_dfa358s'))
+
+
+
+class WorkerFilesTestCase(unittest.TestCase):
+    """Gives each test a Worker over its own data and output directories"""
+
+    table = 'tbl_data_dashboard'
+
+    def setUp(self):
+        self.root = '/etc/calfresh/temp/test_worker'
+        self.inpath, self.outpath = worker.INPATH, worker.OUTPATH
+        worker.INPATH = join(self.root, 'data')
+        worker.OUTPATH = join(self.root, 'out')
+        for stage in ['xlsx', 'csv_in', 'csv_out']:
+            makedirs(join(worker.INPATH, self.table, stage))
+
+        self.worker = Worker(self.table, catalog=FileCatalog(worker.INPATH))
+        self.worker.build_cache = BuildCache(join(self.root, 'state.db'))
+        self.county_aliases = file_factory.county_aliases
+        file_factory.county_aliases = CountyAliases(join(self.root, 'state.db'))
+
+    def tearDown(self):
+        worker.INPATH, worker.OUTPATH = self.inpath, self.outpath
+        file_factory.county_aliases = self.county_aliases
+        rmtree(self.root)
+
+    def write(self, stage, filename, content='county\nAlameda\n'):
+        path = join(worker.INPATH, self.table, stage, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        self.worker.catalog.add(path)
+        return path
+
+
+class TestWorkerCatalog(WorkerFilesTestCase):
+
+    def test_redistribute_data_dashboard_files(self):
+        path = self.write('csv_out', 'CFDashboard-Annual.csv')
+
+        self.worker.redistribute_data_dashboard_files(self.worker.get_csv_output())
+        self.assertEqual(listdir(worker.OUTPATH), ['CFDashboard-Annual.csv'])
+        # copied, so the next run can reuse it
+        self.assertTrue(exists(path))
+        self.assertEqual(len(self.worker.get_csv_output()), 1)
+
+    def test_remove_junk_files(self):
+        junk = self.write('csv_in', 'CFDashboard-DataDictionary.csv')
+        data = self.write('csv_in', 'CFDashboard-Annual.csv')
+
+        self.worker.remove_junk_files(self.worker.get_csv_input())
+        self.assertFalse(exists(junk))
+        self.assertEqual(
+            [item['path'] for item in self.worker.get_csv_input()], [data]
+        )
+
+
+class TestWorkerBuilds(WorkerFilesTestCase):
+
+    def setUp(self):
+        super(TestWorkerBuilds, self).setUp()
+        self.xlsx = self.write('xlsx', 'CFDashboard.xlsx', 'workbook')
+        self.write('csv_out', 'CFDashboard-Annual.csv')
+        self.factory_version = worker.FACTORY_VERSION
+
+    def tearDown(self):
+        worker.FACTORY_VERSION = self.factory_version
+        super(TestWorkerBuilds, self).tearDown()
+
+    def record_build(self):
+        self.worker.build_cache.record(
+            self.table,
+            'CFDashboard.xlsx',
+            hash_file(self.xlsx)[0],
+            FACTORY_VERSION,
+            ['CFDashboard-Annual.csv'],
+        )
+
+    def test_unbuilt(self):
+        self.assertEqual(len(self.worker.get_changed_workbooks()), 1)
+        self.assertEqual(list(self.worker.builds), ['CFDashboard.xlsx'])
+
+    def test_unchanged(self):
+        self.record_build()
+        self.assertEqual(self.worker.get_changed_workbooks(), [])
+        self.assertEqual(self.worker.builds, {})
+
+    def test_changed_workbook(self):
+        self.record_build()
+        self.write('xlsx', 'CFDashboard.xlsx', 'revised workbook')
+
+        jobs = self.worker.get_changed_workbooks()
+        self.assertEqual([item['path'] for item, sheets in jobs], [self.xlsx])
+        self.assertEqual(
+            self.worker.builds['CFDashboard.xlsx']['sha256'], hash_file(self.xlsx)[0]
+        )
+
+    def test_new_factory_version(self):
+        self.record_build()
+        worker.FACTORY_VERSION = FACTORY_VERSION + 1
+        self.assertEqual(len(self.worker.get_changed_workbooks()), 1)
+
+    def test_missing_output(self):
+        self.record_build()
+        self.worker._remove(self.worker.get_csv_output()[0])
+        self.assertEqual(len(self.worker.get_changed_workbooks()), 1)
+
+    def test_get_pending_csv_input(self):
+        self.write('csv_in', 'Old-Annual.csv')
+        pending = self.write('csv_in', 'CFDashboard-Annual.csv')
+        self.worker.builds['CFDashboard.xlsx'] = {'sha256': '', 'inputs': [pending], 'outputs': []}
+
+        self.assertEqual(
+            [item['path'] for item in self.worker.get_pending_csv_input()], [pending]
+        )
+
+
+class TestWorkerConversions(WorkerFilesTestCase):
+
+    def write_workbook(self, filename):
+        path = join(worker.INPATH, self.table, 'xlsx', filename)
+        workbook = Workbook()
+        workbook.active.title = 'Annual'
+        workbook.active.append([u'County', u'Cases'])
+        workbook.active.append([u'Alameda', 15733])
+        workbook.create_sheet('DataDictionary').append([u'Cases'])
+        workbook.save(path)
+        self.worker.catalog.add(path)
+        return path
+
+    def test_excel_to_csv(self):
+        self.write_workbook('CFDashboard17.xlsx')
+        self.write('xlsx', 'CFDashboard18.xlsx', 'not a workbook')
+        self.write_workbook('CFDashboard19.xlsx')
+
+        self.worker.excel_to_csv()
+
+        # the broken workbook is left for next run, the others convert anyway
+        self.assertEqual(
+            sorted(self.worker.builds), ['CFDashboard17.xlsx', 'CFDashboard19.xlsx']
+        )
+        self.assertEqual(
+            [item['filename'] for item in self.worker.get_pending_csv_input()],
+            ['CFDashboard17-Annual.csv', 'CFDashboard19-Annual.csv'],
+        )
+        for item in self.worker.get_pending_csv_input():
+            df = storage_for(item['path']).read(item['path'])
+            self.assertEqual(df.values.tolist(), [['Alameda', 15733]])
+
+    def test_excel_to_csv_big_broken_workbook(self):
+        self.write_workbook('CFDashboard17.xlsx')
+        self.write('xlsx', 'CFDashboard18.xlsx', 'not a workbook')
+        self.split_workbook_bytes = worker.SPLIT_WORKBOOK_BYTES
+        worker.SPLIT_WORKBOOK_BYTES = 0
+        try:
+            self.worker.excel_to_csv()
+        finally:
+            worker.SPLIT_WORKBOOK_BYTES = self.split_workbook_bytes
+
+        # opening it to split it up doesn't sink the table
+        self.assertEqual(list(self.worker.builds), ['CFDashboard17.xlsx'])
+
+
+class TestWorkerFactories(WorkerFilesTestCase):
+
+    table = 'tbl_cf296'
+    data = join(dirname(abspath(__file__)), '..', '..', 'data', 'tbl_cf296', 'csv_in')
+
     def test_run_factories(self):
-        pass
+        paths = []
+        for filename in ['CF296FY16-17-Data.csv', 'CF296FY17-18-Data.csv']:
+            path = join(worker.INPATH, self.table, 'csv_in', filename)
+            copy(join(self.data, filename), path)
+            self.worker.catalog.add(path)
+            paths.append(path)
+        paths.append(self.write('csv_in', 'CF296FY15-16-Data.csv', 'not,a\nreport,\n'))
+        self.worker.input_workbooks[paths[0]] = 'CF296FY16-17.xlsx'
+        self.worker.builds['CF296FY16-17.xlsx'] = {'sha256': '', 'inputs': [], 'outputs': []}
+
+        with self.assertRaises(ValueError) as raised:
+            self.worker.run_factories(self.worker.get_csv_input())
+
+        # only the broken file fails, after the others are built
+        self.assertEqual(str(raised.exception), 'Failed to process CF296FY15-16-Data.csv')
+        self.assertEqual(
+            [item['filename'] for item in self.worker.get_csv_output()],
+            ['CF296FY16-17-Data.csv', 'CF296FY17-18-Data.csv'],
+        )
+        self.assertEqual(
+            self.worker.builds['CF296FY16-17.xlsx']['outputs'],
+            [basename(self.worker.get_csv_output()[0]['path'])],
+        )
+
+
+class TestWorkerMerges(WorkerFilesTestCase):
+
+    table = 'tbl_dfa358f'
+
+    def setUp(self):
+        super(TestWorkerMerges, self).setUp()
+        self.worker.manifest = FileManifest(join(self.root, 'state.db'))
+
+        # the same month of the report, as two workbooks
+        self.xlsx = self.write('csv_out', 'DFA358FJul16-Data.csv', (
+            'county,fulldate,cases,households\n'
+            'Alameda,2016-07-01,100,\\N\n'
+            'Alpine,2016-07-01,3,\n'
+        ))
+        self.xls = self.write('csv_out', 'DFA358FJul16-Jul16.csv', (
+            'county,fulldate,cases,households\n'
+            'Alameda,2016-07-01,101,\\N\n'
+        ))
+        # written the other way round, which mustn't matter
+        utime(self.xlsx, (2000000000, 2000000000))
+        utime(self.xls, (1000000000, 1000000000))
+
+        for workbook, output in [('DFA358FJul16.xls', self.xls), ('DFA358FJul16.xlsx', self.xlsx)]:
+            self.worker.build_cache.record(self.table, workbook, '', 1, [basename(output)])
+
+    def fetch(self, workbook, changed=True):
+        url = '/9/DSSDB/DataTables/' + workbook
+        self.worker.manifest.record(url, self.table, workbook, '', 0, changed=changed)
+
+    def get_cases(self):
+        df = self.worker.merge_table(self.table, self.worker.get_csv_output())
+        return df.set_index('county').cases.to_dict()
+
+    def test_merge_by_filename(self):
+        self.assertEqual(self.get_cases(), {'Alameda': '101', 'Alpine': '3'})
+
+    def test_merge_by_fetch(self):
+        self.fetch('DFA358FJul16.xls')
+        self.fetch('DFA358FJul16.xlsx')
+        self.assertEqual(self.get_cases(), {'Alameda': '100', 'Alpine': '3'})
+
+        self.fetch('DFA358FJul16.xls')  # republished
+        self.assertEqual(self.get_cases(), {'Alameda': '101', 'Alpine': '3'})
+
+    def test_merge_by_fetch_unchanged(self):
+        self.fetch('DFA358FJul16.xls')
+        self.fetch('DFA358FJul16.xlsx')
+
+        # fetched again with the same bytes, which mustn't reorder them
+        self.fetch('DFA358FJul16.xls', changed=False)
+        self.assertEqual(self.get_cases(), {'Alameda': '100', 'Alpine': '3'})
 
     def test_merge_for_uploading(self):
-        pass
+        self.worker.merge_for_uploading(self.worker.get_csv_output())
+
+        # the factories' nulls stay nulls and empty fields stay empty
+        with open(join(worker.OUTPATH, 'tbl_dfa358f.csv')) as f:
+            self.assertEqual(f.read(), (
+                'county,fulldate,cases,households\n'
+                'Alameda,2016-07-01,101,\\N\n'
+                'Alpine,2016-07-01,3,\n'
+            ))
+
+
+class TestWorkerTotals(WorkerFilesTestCase):
+
+    table = 'tbl_dfa358tot'
+
+    def setUp(self):
+        super(TestWorkerTotals, self).setUp()
+        keys = {
+            'county': ['Alameda', 'Alpine'],
+            'fulldate': ['2016-07-01', '2016-07-01'],
+            'year': ['2016', '2016'],
+            'quarter': ['3.0', '3.0'],
+            'month': ['JUL', 'JUL'],
+        }
+        columns = ['county', 'fulldate', 'year', 'quarter', 'month', 'cases', 'households']
+        self.federal = pd.DataFrame(
+            dict(keys, cases=['100', '3'], households=['40', '\\N']), columns=columns
+        )
+        self.state = pd.DataFrame(
+            dict(keys, cases=['20', '\\N'], households=['5', '\\N']), columns=columns
+        )
+
+    def read_total(self):
+        return pd.read_csv(join(worker.OUTPATH, 'tbl_dfa358tot.csv'))
 
     def test_combine_358F_and_S(self):
-        pass
+        self.worker.results.add('tbl_dfa358f', self.federal)
+        self.worker.results.add('tbl_dfa358s', self.state)
+        self.worker.combine_358F_and_S()
+
+        df = self.read_total()
+        self.assertEqual(list(df.county), ['Alameda', 'Alpine'])
+        self.assertEqual(list(df.cases), [120, 3])
+        self.assertEqual(df.households[0], 45)
+        self.assertTrue(np.isnan(df.households[1]))
+
+    def test_combine_unmerged(self):
+        # the state table wasn't merged in this run, so its files are merged
+        makedirs(join(worker.INPATH, 'tbl_dfa358s', 'csv_out'))
+        path = join(worker.INPATH, 'tbl_dfa358s', 'csv_out', 'DFA358SJul16-Data.csv')
+        self.state.to_csv(path, index=False)
+        self.worker.catalog.add(path)
+        self.worker.results.add('tbl_dfa358f', self.federal)
+        self.worker.combine_358F_and_S()
+
+        self.assertEqual(list(self.read_total().cases), [120, 3])
+
+    def test_combine_empty(self):
+        self.worker.results.add('tbl_dfa358f', self.federal[:0])
+        self.worker.results.add('tbl_dfa358s', self.state[:0])
+        self.assertRaises(ValueError, self.worker.combine_358F_and_S)
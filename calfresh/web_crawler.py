@@ -6,28 +6,329 @@ Attributes:
     config (RawConfigParser): for reading the configuration file
     temp_dir (str): the temporary directory to use for saving html files
     data_dir (str): the directory containing all the excel and csv files
+    chunk_size (int): the bytes to hold in memory at once while downloading
+    download_attempts (int): how many times to try downloading a file
+    revalidate_files (bool): whether to check files at known urls for changed bytes
+    download_workers (int): the most files each crawler downloads at the same time
+    per_host_connections (int): the most downloads from one host at the same time
+    session (Session): the pooled connections every request goes through
+    rate_limiter (RateLimiter): the bandwidth ceiling all downloads share
     logger (Logger): the object for logging
+    validator_cache (ValidatorCache): the saved validators of every page and
+        file requested, and of every partial download
+    manifest (FileManifest): the content address of every file downloaded
+    link_index (LinkIndex): every excel link ever seen on each table's page
 
 """
 
+from HTMLParser import HTMLParser, HTMLParseError
 import ConfigParser
 import datetime
+import errno
+import json
 import logging.config
 import os
-
-from bs4 import BeautifulSoup
+import shutil
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 import requests
 
+from state import FileManifest, LinkIndex, hash_file
+
 config = ConfigParser.RawConfigParser()
 config.read('/etc/calfresh/calfresh.conf')
 
 temp_dir = config.get('filepaths', 'temp')
 data_dir = config.get('filepaths', 'data')
+chunk_size = config.getint('crawler', 'chunk_size')
+download_attempts = config.getint('crawler', 'download_attempts')
+revalidate_files = config.getboolean('crawler', 'revalidate_files')
+download_workers = config.getint('crawler', 'download_workers')
+per_host_connections = config.getint('crawler', 'per_host_connections')
 
 logging.config.fileConfig(config.get('filepaths', 'config'))
 logger = logging.getLogger('web_crawler')
 
 
+def _build_session():
+    """Build the session all page requests and downloads share
+
+    The session keeps connections to each host alive between requests and
+    retries failed requests with exponential backoff
+
+    Returns:
+        session (Session): the session with the pooling and retries mounted
+
+    """
+    retries = Retry(
+        total=config.getint('crawler', 'retries'),
+        backoff_factor=config.getfloat('crawler', 'backoff_factor'),
+        status_forcelist=[500, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(
+        pool_maxsize=config.getint('crawler', 'pool_size'),
+        max_retries=retries,
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _get_timeout(url):
+    """Get the connect and read timeouts for the url's host
+
+    Args:
+        url (str): the url about to be requested
+
+    Returns:
+        timeout (tuple of float): the connect and read timeouts in seconds, from
+        the host's option in the [timeouts] section or else the default one
+
+    """
+    host = urlparse(url).netloc.lower()
+    option = host if config.has_option('timeouts', host) else 'default'
+    return tuple(float(t) for t in config.get('timeouts', option).split(','))
+
+
+class RateLimiter(object):
+    """Keeps the combined rate of every download under a ceiling by giving each
+        chunk its own slot of time to arrive in
+
+    Args:
+        rate (int): the most bytes per second, or 0 for no limit
+
+    """
+    def __init__(self, rate):
+        super(RateLimiter, self).__init__()
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_slot = time.time()
+
+    def consume(self, size):
+        """Wait until another size bytes fit under the ceiling
+
+        Args:
+            size (int): the number of bytes about to be received
+
+        """
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_slot)
+            self.next_slot = start + float(size) / self.rate
+
+        if start > now:
+            time.sleep(start - now)
+
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+
+def _get_host_slots(url):
+    """Get the semaphore capping how many downloads run against the url's host,
+        shared by every crawler so concurrent tables can't exceed it either
+
+    Args:
+        url (str): the url about to be downloaded
+
+    Returns:
+        slots (BoundedSemaphore): the host's semaphore
+
+    """
+    host = urlparse(url).netloc.lower()
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(per_host_connections)
+        return _host_slots[host]
+
+
+def _move_into_place(path, filepath):
+    """Move a finished download to where it belongs in one step, so the Worker
+        never sees a truncated workbook
+
+    A rename is only atomic within a filesystem, so when the temp directory is
+    on another one the file is copied next to where it belongs and renamed
+    from there instead
+
+    Args:
+        path (str): the finished file in the temp directory
+        filepath (str): where the file belongs
+
+    """
+    try:
+        os.rename(path, filepath)
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            raise
+
+        # named so it's never taken for a workbook while it's being copied
+        handle, staged = tempfile.mkstemp(prefix='.download-', dir=os.path.dirname(filepath))
+        os.close(handle)
+        try:
+            shutil.copyfile(path, staged)
+            os.rename(staged, filepath)
+        except Exception:
+            os.remove(staged)
+            raise
+        os.remove(path)
+
+
+session = _build_session()
+rate_limiter = RateLimiter(config.getint('crawler', 'max_bytes_per_second'))
+
+
+class ValidatorCache(object):
+    """Saves the ETag and Last-Modified validators each url last responded with,
+        so the next request for it can be made conditional
+
+    Args:
+        path (str): the json file the validators are saved to between runs
+
+    Attributes:
+        validators (dict): the urls mapped to their etag and last_modified values
+
+    """
+    def __init__(self, path):
+        super(ValidatorCache, self).__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        self.validators = self._load()
+
+    def _load(self):
+        """Read the saved validators, starting over if the file is missing or corrupt"""
+        if not os.path.exists(self.path):
+            return {}
+
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            logger.error('Unreadable validator cache: %s', self.path)
+            return {}
+
+    def _save(self):
+        """Write the validators to a temp file and swap it in so a crash can't
+            leave a half written cache behind"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.validators, f, indent=2, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    def headers(self, url):
+        """Get the conditional request headers for the url
+
+        Args:
+            url (str): the url about to be requested
+
+        Returns:
+            headers (dict): If-None-Match and If-Modified-Since, when known
+
+        """
+        with self.lock:
+            cached = self.validators.get(url, {})
+
+        headers = {}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    def update(self, url, response_headers):
+        """Save the validators from a response that has been fully processed
+
+        Args:
+            url (str): the url that was requested
+            response_headers (dict): the headers the url responded with
+
+        """
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+
+        with self.lock:
+            if etag or last_modified:
+                self.validators[url] = {
+                    'etag': etag,
+                    'last_modified': last_modified,
+                }
+            else:
+                self.validators.pop(url, None)
+            self._save()
+
+
+class LinkExtractor(HTMLParser):
+    """Collects the href of every anchor while the html streams through it,
+        without building a tree of the rest of the page
+
+    Attributes:
+        links (set of str): the hrefs found so far
+
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)  # HTMLParser is an old style class
+        self.links = set()
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.links.add(str(dict(attrs).get('href')))
+
+
+_link_cache = {}
+_link_cache_lock = threading.Lock()
+
+
+def extract_links(page):
+    """Get the href of every anchor on a saved page, parsing each snapshot at
+        most once no matter how many PageParsers ask for it
+
+    Args:
+        page (str): the path to the saved html
+
+    Returns:
+        links (frozenset of str): the hrefs of all the anchors on the page
+
+    """
+    stat = os.stat(page)
+    key = (page, stat.st_mtime, stat.st_size)
+    with _link_cache_lock:
+        if key in _link_cache:
+            return _link_cache[key]
+
+    with open(page, 'r') as f:
+        html = f.read()
+
+    extractor = LinkExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+        links = frozenset(extractor.links)
+    except HTMLParseError as ex:  # BeautifulSoup is more forgiving of bad html
+        logger.warning('Falling back to BeautifulSoup for %s: %s', page, ex)
+        soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('a'))
+        links = frozenset(str(url.get('href')) for url in soup.find_all('a'))
+
+    with _link_cache_lock:
+        _link_cache[key] = links
+    return links
+
+
+validator_cache = ValidatorCache(config.get('filepaths', 'validators'))
+manifest = FileManifest()
+link_index = LinkIndex()
+
+
 class WebCrawler(object):
     """The WebCrawler gets today's and yesterday's html files for a given url
         and uses the PageParser to identify new and updated files
@@ -44,30 +345,61 @@ class WebCrawler(object):
         super(WebCrawler, self).__init__()
         self.table = table
         self.url = url
+        self.page_headers = {}
+        self.page_not_modified = False
+        self.failed_paths = []
 
     def crawl(self):
         """Do the needful: get all the html pages, identify new urls, and return them"""
         new_page = self._get_new_page()
         old_page = self._get_old_page()
 
+        changed_files = []
         # if we successfully received today's page
         if new_page:
-            parser = PageParser(self.table, new_page, old_page)
+            parser = PageParser(self.table, new_page, old_page, link_index)
             parser.parse()
 
-            if len(parser.updated_paths) > 0:  # if there's new urls
-                self._download_new_files(parser.updated_paths)
-                return self.table
+            paths = list(parser.updated_paths)
+            if revalidate_files:  # files re-published under the same url
+                paths += sorted(parser.all_paths.difference(parser.updated_paths))
+
+            changed_files = self._download_new_files(paths)
+
+            # only trust the links and validators once their files have been
+            # downloaded, otherwise a failed download would never be retried
+            link_index.record(
+                self.table,
+                parser.all_paths.difference(self.failed_paths),
+            )
+            if not self.failed_paths:
+                validator_cache.update(self.url, self.page_headers)
+
+        # the page is the same, but its files can still be re-published
+        elif self.page_not_modified and revalidate_files:
+            changed_files = self._download_new_files(sorted(link_index.urls(self.table)))
+
+        if len(changed_files) > 0:
+            return self.table
 
     def _get_new_page(self):
-        """Get the html page as it exists today"""
+        """Get the html page as it exists today, unless it hasn't changed"""
         try:
-            page = requests.request('GET', self.url)
+            page = session.get(
+                self.url,
+                headers=validator_cache.headers(self.url),
+                timeout=_get_timeout(self.url),
+            )
         except Exception as ex:
             logger.exception(ex)
             return
 
-        if page.status_code != 200:
+        if page.status_code == 304:
+            logger.info('Page not modified: %s', self.url)
+            self.page_not_modified = True
+            self._carry_forward_old_page()
+
+        elif page.status_code != 200:
             logger.error('Requested page not received! Page: {}, Status code: {}'.format(
                 self.url,
                 page.status_code,
@@ -80,8 +412,19 @@ class WebCrawler(object):
             with open(filepath, 'w') as f:
                 f.write(page.text.encode('ascii', 'ignore'))
 
+            self.page_headers = page.headers
             return filepath
 
+    def _carry_forward_old_page(self):
+        """Rename yesterday's unchanged page to today's so tomorrow's diff has it"""
+        old_page = self._get_old_page()
+        new_page = os.path.join(
+            temp_dir,
+            self.table + '_' + str(datetime.date.today()),
+        )
+        if os.path.exists(old_page) and not os.path.exists(new_page):
+            os.rename(old_page, new_page)
+
     def _get_old_page(self):
         """Return the string path of yesterday's file"""
         yesterday = datetime.date.today() - datetime.timedelta(days=1)
@@ -90,24 +433,230 @@ class WebCrawler(object):
     def _download_new_files(self, updated_paths):
         """For updated link in new page, download the file
 
+        The files are downloaded concurrently, at most per_host_connections at
+        a time from each host. A file that fails is logged and added to
+        failed_paths without stopping the others
+
         Args:
             updated_paths (list of str): the urls containing new or updated files
 
+        Returns:
+            changed_files (list of str): the files whose bytes are new to us
+
         Outputs:
             Excel files in their corresponding table's directory
 
         """
-        for path in updated_paths:
-            if 'http' not in path:
-                path = 'http://www.cdss.ca.gov' + path
+        if not updated_paths:
+            return []
 
-            filename = self._get_filename(path)
+        def download(path):
+            url = path
+            if 'http' not in url:
+                url = 'http://www.cdss.ca.gov' + url
+
+            filename = self._get_filename(url)
             fp = os.path.join(data_dir, self.table, 'xlsx', filename)
 
-            response = requests.get(path)
-            with open(fp, 'wb') as output:
-                output.write(response.content)
-                logger.info('Downloaded %s', fp)
+            try:
+                with _get_host_slots(url):
+                    if self._download_file(url, fp):
+                        logger.info('Downloaded %s', fp)
+                        return fp
+            except Exception as ex:
+                logger.exception(ex)
+                self.failed_paths.append(path)
+
+        pool = ThreadPool(processes=max(1, min(download_workers, len(updated_paths))))
+        try:
+            results = pool.map(download, updated_paths)
+        finally:
+            pool.close()
+            pool.join()
+
+        return [fp for fp in results if fp]
+
+    def _download_file(self, url, filepath):
+        """Stream a file into a partial file in the temp directory and move it
+            into place once it's complete, resuming the partial file if a
+            previous attempt was interrupted
+
+        Files whose content we already have on disk, either at this url or
+        another one for the same table, are discarded instead of being moved
+        into place. The manifest is only trusted for files that are still there
+
+        Args:
+            url (str): the url of the excel file
+            filepath (str): where the finished file belongs
+
+        Returns:
+            bool: True if new bytes were saved to the filepath
+
+        Raises:
+            IOError: If the download still fails after all the attempts
+
+        """
+        part_path = os.path.join(
+            temp_dir,
+            self.table + '_' + os.path.basename(filepath) + '.part',
+        )
+        known = manifest.get(url)
+        if known is not None and not os.path.exists(filepath):
+            # without the file its validators would only get us a 304
+            known = None
+        started = time.time()
+        # the bytes every attempt wrote, not just the last one, since the
+        # elapsed time covers them all
+        progress = {'received': 0}
+
+        attempt = 1
+        while True:
+            try:
+                response_headers, _ = self._stream_to_file(url, part_path, known, progress)
+                break
+            except IOError as ex:  # requests' exceptions are IOErrors too
+                if attempt >= download_attempts:
+                    raise
+                logger.warning('Download of %s interrupted, resuming: %s', url, ex)
+                attempt += 1
+
+        if response_headers is None:  # not modified since we last fetched it
+            return False
+
+        elapsed = max(time.time() - started, 0.001)
+        received = progress['received']
+        logger.info(
+            'Received %s: %d bytes in %.2fs (%.1f KB/s)',
+            url,
+            received,
+            elapsed,
+            received / elapsed / 1024,
+        )
+
+        sha256, size = hash_file(part_path, chunk_size)
+        if self._have_content(sha256, filepath):
+            logger.info('Already have the content of %s', url)
+            os.remove(part_path)
+            changed = False
+        else:
+            _move_into_place(part_path, filepath)
+            changed = True
+
+        # the file's own validators are kept in the manifest
+        validator_cache.update(part_path, {})
+
+        manifest.record(
+            url,
+            self.table,
+            os.path.basename(filepath),
+            sha256,
+            size,
+            etag=response_headers.get('ETag'),
+            last_modified=response_headers.get('Last-Modified'),
+            changed=changed,
+        )
+        return changed
+
+    def _have_content(self, sha256, filepath):
+        """Check if a file with these bytes is already in the table's directory
+
+        Args:
+            sha256 (str): the hex digest of the downloaded content
+            filepath (str): where the downloaded file belongs
+
+        Returns:
+            bool: True if the manifest's files with the same content, or the
+            file already at the filepath, are on disk with these bytes
+
+        """
+        directory = os.path.dirname(filepath)
+        for filename in manifest.filenames(self.table, sha256):
+            if os.path.exists(os.path.join(directory, filename)):
+                return True
+
+        return os.path.exists(filepath) and hash_file(filepath, chunk_size)[0] == sha256
+
+    def _stream_to_file(self, url, part_path, known=None, progress=None):
+        """Append the rest of the url's content to the partial file in chunks
+
+        Args:
+            url (str): the url of the excel file
+            part_path (str): the partial file to write to
+            known (dict): the manifest entry from the last time the url was fetched
+            progress (dict): counts the bytes written under received, including
+                those of an attempt that fails
+
+        Returns:
+            headers (dict or None): the response headers, or None if the file
+            hasn't been modified since it was last fetched
+            received (int): the number of bytes written to the partial file
+
+        Raises:
+            IOError: If the response ends before all of its content arrived
+
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        if offset:
+            # only resume if the file hasn't changed since the partial was
+            # started, otherwise two versions of it could be spliced together
+            validators = validator_cache.headers(part_path)
+            if_range = validators.get('If-None-Match') or \
+                validators.get('If-Modified-Since')
+            if not if_range:
+                logger.info('No validator to resume %s with, starting over', url)
+                os.remove(part_path)
+                offset = 0
+
+        # the bytes as they're stored, so Content-Length and Range count the
+        # same bytes that get written to the partial file
+        headers = {'Accept-Encoding': 'identity'}
+        if not offset and known:
+            if known['etag']:
+                headers['If-None-Match'] = known['etag']
+            if known['last_modified']:
+                headers['If-Modified-Since'] = known['last_modified']
+        elif offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = if_range
+
+        response = session.get(
+            url,
+            headers=headers,
+            stream=True,
+            timeout=_get_timeout(url),
+        )
+        try:
+            if response.status_code == 304:
+                return None, 0
+            if response.status_code == 416:  # the partial file is unusable
+                os.remove(part_path)
+                raise IOError('Range not satisfiable for {}'.format(url))
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                mode = 'ab'
+            else:  # the server sent the whole file
+                mode = 'wb'
+                offset = 0
+                # the version the partial file holds, so it can be resumed
+                validator_cache.update(part_path, response.headers)
+
+            expected = response.headers.get('Content-Length')
+            with open(part_path, mode) as output:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    rate_limiter.consume(len(chunk))
+                    output.write(chunk)
+                    if progress is not None:
+                        progress['received'] += len(chunk)
+        finally:
+            response.close()
+
+        received = os.path.getsize(part_path) - offset
+        if expected is not None and received != int(expected):
+            raise IOError('Incomplete download of {}'.format(url))
+
+        return response.headers, received
 
     def _get_filename(self, path):
         """Get the file name from the url
@@ -125,50 +674,71 @@ class WebCrawler(object):
 
         return filename
 
-    def clean_up(self):
-        """Remove the html files that are older than yesterday's"""
+    @staticmethod
+    def clean_up():
+        """Remove the html files that are older than yesterday's, and the
+            partial downloads abandoned for as long along with their validators"""
         two_days_ago = datetime.date.today() - datetime.timedelta(days=2)
+        cutoff = time.time() - 2 * 24 * 60 * 60
         for root, dirs, files in os.walk(temp_dir):
             for file in files:
+                path = os.path.join(temp_dir, file)
                 if file.endswith(str(two_days_ago)):
-                    os.remove(os.path.join(temp_dir, file))
+                    os.remove(path)
+                elif file.endswith('.part') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    validator_cache.update(path, {})
 
 
 class PageParser(object):
-    """This class looks for new Excel files by comparing today's and yesterday's pages
+    """This class looks for new Excel files by comparing today's page to the links
+        in the LinkIndex, or to yesterday's page when there's no index
 
     Args:
         table (str): the table whose pages to get
         new_page (str): a link to the saved html
-        old_page (str): another link to saved html
+        old_page (str): another link to saved html, only read without a link
+            index or to seed an empty one
+        link_index (LinkIndex): every excel link seen on previous runs
 
     Attributes:
-        new_soup (BeautifulSoup obj): parsed html from today's page
-        old_soup (BeautifulSoup obj): parsed html from yesterday's page
+        new_links (set of str): the hrefs of all the anchors on today's page
+        old_links (set of str): the hrefs of all the anchors on yesterday's page
         updated_paths (list of str): all the new excel file urls
+        all_paths (set of str): every excel file url on today's page
 
     """
-    def __init__(self, table, new_page, old_page):
+    def __init__(self, table, new_page, old_page=None, link_index=None):
         super(PageParser, self).__init__()
         self.table = table
         self.new_page = new_page
         self.old_page = old_page
-        self.new_soup = None
-        self.old_soup = None
+        self.link_index = link_index
+        self.new_links = None
+        self.old_links = None
         self.updated_paths = []
+        self.all_paths = set()
 
     def parse(self):
-        """Load the html into BeautifulSoup and get the new excel urls"""
+        """Extract the links from the html and get the new excel urls"""
         self._load_page_content()
         self._get_new_urls()
 
     def _load_page_content(self):
-        """Extract the new and old html into beautiful soup objects"""
-        with open(self.new_page, 'r') as new:
-            self.new_soup = BeautifulSoup(new.read(), 'html.parser')
+        """Extract the links from the new and old html"""
+        self.new_links = extract_links(self.new_page)
+
+        if self._needs_old_page():
+            self.old_links = extract_links(self.old_page)
 
-        with open(self.old_page, 'r') as old:
-            self.old_soup = BeautifulSoup(old.read(), 'html.parser')
+    def _needs_old_page(self):
+        """Yesterday's page is only needed without a link index, or to seed an
+            empty one so every link on today's page doesn't look new"""
+        if self.link_index is None:
+            return True
+
+        return self.old_page is not None and os.path.exists(self.old_page) and \
+            len(self.link_index.urls(self.table)) == 0
 
     def _get_all_xls_urls(self, url_list):
         """Extract the urls to excel files from all urls found
@@ -187,12 +757,18 @@ class PageParser(object):
         return file_urls
 
     def _get_new_urls(self):
-        """Get any excel file urls that changed or weren't there yesterday"""
-        all_new_urls = [str(url.get('href')) for url in self.new_soup.find_all('a')]
-        all_old_urls = [str(url.get('href')) for url in self.old_soup.find_all('a')]
-
-        new_xls_url_set = self._get_all_xls_urls(all_new_urls)
-        old_xls_url_set = self._get_all_xls_urls(all_old_urls)
+        """Get any excel file urls that changed or were never seen before"""
+        new_xls_url_set = self._get_all_xls_urls(self.new_links)
+        self.all_paths = new_xls_url_set
+
+        old_xls_url_set = set()
+        if self.old_links is not None:
+            old_xls_url_set = self._get_all_xls_urls(self.old_links)
+
+        if self.link_index is not None:
+            if old_xls_url_set:  # seeding an empty index from yesterday's page
+                self.link_index.record(self.table, old_xls_url_set)
+            old_xls_url_set = self.link_index.urls(self.table)
 
         for url in new_xls_url_set:
             if url not in old_xls_url_set:
@@ -2,6 +2,9 @@
 """This is the main file for converting excel to csv files, processing those
 csv files, and merging them for upload to calfreshdb
 
+The files between the stages are kept in the format of the storage module,
+named after the csv files they stand in for
+
 Output:
     writes files to the <outpath> defined after the import statements
 
@@ -9,16 +12,26 @@ Output:
 
 from csv import writer
 from datetime import datetime
-from os import walk, remove, makedirs
-from os.path import join, exists
-from shutil import move
+from itertools import groupby
+from multiprocessing import Pool
+from operator import itemgetter
+from os import remove, makedirs
+from os.path import basename, dirname, getsize, join, exists
+from threading import Lock, active_count
 import ConfigParser
 import logging.config
+import traceback
 
-from xlrd import open_workbook
+from pandas.io.parsers import TextParser
+import numpy as np
 import pandas as pd
 
-from file_factory import initialize
+from catalog import FileCatalog
+from constants import junk_sheet_default, junk_sheet_map, merge_keys
+from file_factory import FACTORY_VERSION, initialize
+from readers import open_reader
+from state import BuildCache, FileManifest, hash_file
+from storage import STORAGE, storage_for
 
 config = ConfigParser.RawConfigParser()
 config.read('/etc/calfresh/calfresh.conf')
@@ -30,29 +43,492 @@ INPATH = config.get('filepaths', 'data')
 now = datetime.now()
 OUTPATH = '/etc/calfresh/{}_{}_{}'.format(now.month, now.day, now.year)
 
+# how many processes convert workbooks, and how big an .xls workbook has to be
+# before its sheets are converted in separate processes too
+PROCESSES = config.getint('worker', 'processes')
+SPLIT_WORKBOOK_BYTES = config.getint('worker', 'split_workbook_bytes')
+
+# whether sheets go straight from the workbooks to the factories as DataFrames,
+# and whether the csv_in files are written anyway to look at what came in
+IN_MEMORY = config.getboolean('worker', 'in_memory')
+DEBUG = config.getboolean('worker', 'debug')
+
+# the data dashboard sheets are saved under the names of their tables
+DASHBOARD_OUTPUTS = {
+    'CFDashboard-Annual.csv': 'tbl_data_dashboard_annual.csv',
+    'CFDashboard-Quarterly.csv': 'tbl_data_dashboard_quarterly.csv',
+    'CFDashboard-Every_Mth.csv': 'tbl_data_dashboard_monthly.csv',
+    'CFDashboard-Every_3_Mth.csv': 'tbl_data_dashboard_3mth.csv',
+    'CFDashboard-PRI_Raw.csv': 'tbl_data_dashboard_pri_raw.csv',
+}
+
+
+# the pool of processes every Worker in a run shares, once start_pool is called
+_pool = None
+
+
+def start_pool(processes=PROCESSES):
+    """Start the pool of processes the Workers share, before starting any threads
+
+    Forking while another thread holds a lock, like a logging handler's or
+    sqlite's, leaves the lock held for good in the child, so a pool forked
+    from the app's crawl and work threads can deadlock. Its processes are
+    forked here instead, while the main thread is the only one
+
+    Args:
+        processes (int): how many processes to start
+
+    Returns:
+        started (bool): whether the pool was started here, rather than before
+
+    """
+    global _pool
+    if _pool is not None or processes < 2:
+        return False
+    _pool = Pool(processes=processes)
+    return True
+
+
+def stop_pool():
+    """Wait for the shared pool's processes to finish and let them go"""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+
+
+def run_in_processes(func, jobs, processes=PROCESSES):
+    """Run the jobs in a pool of processes, or in this one if there's no point
+
+    The shared pool is used if it was started. Otherwise a pool is forked for
+    the jobs, unless other threads are running, in which case the jobs run
+    in this process
+
+    Args:
+        func (function): a module level function, so it can be pickled
+        jobs (list): the argument for each call of func
+        processes (int): the most processes to run at the same time
+
+    Returns:
+        results (list): the result of each job, in the same order as the jobs
+
+    """
+    if processes < 2 or len(jobs) < 2:
+        return [func(job) for job in jobs]
+
+    if _pool is not None:
+        return _pool.map(func, jobs, chunksize=1)
+
+    if active_count() > 1:
+        logger.warning('Not forking a pool from a threaded process, running here')
+        return [func(job) for job in jobs]
+
+    pool = Pool(processes=min(processes, len(jobs)))
+    try:
+        return pool.map(func, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def is_junk_file(source, filename):
+    """Check a csv filename against its table's junk sheet patterns
+
+    Args:
+        source (str): the table the file belongs to
+        filename (str): the csv filename, <workbook>-<sheet>.csv
+
+    Returns:
+        bool: True if the file doesn't contain relevant data
+
+    """
+    patterns = junk_sheet_map.get(source, junk_sheet_default)
+    return any(pattern in filename for pattern in patterns)
+
+
+def get_csv_filename(item, sheet):
+    """Get the name of the csv file a sheet of an excel file is converted to
+
+    Args:
+        item (dict): dict with keynames path, source, and filename
+        sheet (str): the name of the sheet
+
+    Returns:
+        the excel filename without its suffix, joined to the sheet name
+
+    """
+    return item['filename'].split('.xls')[0] + '-' + sheet + '.csv'
+
+
+def get_relevant_sheets(item, workbook):
+    """Get the sheets of a workbook worth converting, without loading any of them
+
+    Args:
+        item (dict): dict with keynames path, source, and filename
+        workbook (XlsReader or XlsxReader): the reader of the workbook
+
+    Returns:
+        sheets (list of str): the names of the sheets that aren't junk
+
+    """
+    return [
+        name for name in workbook.sheet_names()
+        if not is_junk_file(item['source'], get_csv_filename(item, name))
+    ]
+
+
+def write_sheet(rows, csv_path):
+    """Write a sheet of an excel file out to csv, a row at a time
+
+    Args:
+        rows (iterable of lists): the values of the sheet's rows, from a reader
+        csv_path (str): the path of the csv file to write
+
+    """
+    with open(csv_path, 'wb') as handle:
+        author = writer(handle)
+        for row in rows:
+            author.writerow([unicode(value).encode('utf-8') for value in row])
+
+
+def sheet_to_frame(rows):
+    """Read a sheet of an excel file into a DataFrame the way pd.read_csv would
+        read its csv file, without writing the csv file
+
+    The header row names the columns and the column types are inferred, with
+    pandas' own parser. Text is encoded to utf-8 like the csv files are, but
+    numbers stay floats instead of being rounded to text and parsed back
+
+    Args:
+        rows (iterable of lists): the values of the sheet's rows, from a reader
+
+    Returns:
+        df (pandas DataFrame): the sheet's data
+
+    """
+    rows = [
+        [value.encode('utf-8') if isinstance(value, unicode) else value for value in row]
+        for row in rows
+    ]
+    return TextParser(rows, header=0).read()
+
+
+def store_sheet(rows, path):
+    """Store a sheet of an excel file in csv_in, streaming it a row at a time
+        when it's stored as csv
+
+    Args:
+        rows (iterable of lists): the values of the sheet's rows, from a reader
+        path (str): the path of the file to write
+
+    """
+    if STORAGE.typed:
+        STORAGE.write(sheet_to_frame(rows), path)
+    else:
+        write_sheet(rows, path)
+
+
+def get_stored_items(catalog, table, stage):
+    """Get a table's files in a stage that are kept in the current storage
+
+    Args:
+        catalog (FileCatalog): the index of the data directory
+        table (str): the table the files belong to
+        stage (str): csv_in or csv_out
+
+    Returns:
+        paths (list of dicts): contains the dict objects representing the path,
+        source, and filename of each file, where the filename is the name of
+        the csv file it stands in for
+
+    """
+    items = []
+    for item in catalog.get(table, stage):
+        if STORAGE.is_stored(item['filename']):
+            item['filename'] = STORAGE.csv_name(item['filename'])
+            items.append(item)
+    return items
+
+
+def get_csv_item(item, sheet):
+    """Get the item dict for the csv file a sheet of an excel file converts to
+
+    Args:
+        item (dict): dict with keynames path, source, and filename
+        sheet (str): the name of the sheet
+
+    Returns:
+        csv_item (dict): dict with keynames path, source, and filename, where
+        the path is the stored file's
+
+    """
+    filename = get_csv_filename(item, sheet)
+    return {
+        'path': join(INPATH, item['source'], 'csv_in', STORAGE.stored_name(filename)),
+        'source': item['source'],
+        'filename': filename,
+    }
+
+
+def convert_workbook(job):
+    """Convert the sheets of an excel file to stored files in its table's csv_in
+        directory, catching any failure so one bad file can't sink the others
+
+    Args:
+        job (tuple): the item dict of the excel file with keynames path, source,
+            and filename, and the names of the sheets to convert or None for
+            all the relevant ones
+
+    Returns:
+        result (tuple): the item, the paths of the files written in sheet
+        order, and the traceback if the conversion failed or else None
+
+    """
+    item, sheets = job
+    try:
+        # junk sheets are skipped before they're read, so they're never decoded
+        workbook = open_reader(item['path'])
+        if sheets is None:
+            sheets = get_relevant_sheets(item, workbook)
+
+        csv_paths = []
+        for name in sheets:
+            csv_path = get_csv_item(item, name)['path']
+            store_sheet(workbook.rows(name), csv_path)
+            csv_paths.append(csv_path)
+
+        workbook.close()
+        return item, csv_paths, None
+    except Exception:
+        return item, [], traceback.format_exc()
+
+
+def build_workbook(job):
+    """Read the sheets of an excel file straight into their factories and store
+        the results in its table's csv_out directory, skipping csv_in
+
+    The csv_in files are still written as csv when debugging, but never read back
+
+    Args:
+        job (tuple): the item dict of the excel file with keynames path, source,
+            and filename, and the names of the sheets to build or None for
+            all the relevant ones
+
+    Returns:
+        result (tuple): the item, the paths of the files built, the
+        traceback if the workbook couldn't be read or else None, and the
+        filename and traceback of each sheet that failed in its factory
+
+    """
+    item, sheets = job
+    try:
+        workbook = open_reader(item['path'])
+        if sheets is None:
+            sheets = get_relevant_sheets(item, workbook)
+
+        csv_paths, failed = [], []
+        for name in sheets:
+            rows = list(workbook.rows(name))
+            csv_item = get_csv_item(item, name)
+            if DEBUG:
+                write_sheet(rows, join(dirname(csv_item['path']), csv_item['filename']))
+            csv_item['df'] = sheet_to_frame(rows)
+            del rows
+
+            _, csv_path, error = build_file(csv_item)
+            if error:
+                failed.append((csv_item['filename'], error))
+            else:
+                csv_paths.append(csv_path)
+
+        workbook.close()
+        return item, csv_paths, None, failed
+    except Exception:
+        return item, [], traceback.format_exc(), []
+
+
+def build_file(item):
+    """Run a csv file through its factory and store the result in its table's
+        csv_out directory, catching any failure so the other files still run
+
+    Args:
+        item (dict): dict with keynames path, source, and filename, and the
+            DataFrame under df if it was read from the workbook directly
+
+    Returns:
+        result (tuple): the item, the path of the file written, and the
+        traceback if the factory failed or else None
+
+    """
+    try:
+        factory = initialize(item)
+        factory.build()
+
+        csv_path = join(
+            INPATH,
+            item['source'],
+            'csv_out',
+            STORAGE.stored_name(DASHBOARD_OUTPUTS.get(item['filename'], item['filename'])),
+        )
+        STORAGE.write(factory.df, csv_path)
+        return item, csv_path, None
+    except Exception:
+        return item, None, traceback.format_exc()
+    finally:
+        item.pop('df', None)  # let the frame go as soon as it's built
+
+
+def read_for_merging(path):
+    """Read a csv_out file for merging, so its values are written back out as is
+
+    Typed storage hands back the columns as they were stored. Csv files are
+    read as text, so their values aren't rounded on the way through. Either
+    way the factories' '\N' nulls are kept as they are, so they're written
+    back out as nulls while empty fields are written back out empty
+
+    Args:
+        path (str): the path of the stored file
+
+    Returns:
+        df (pandas DataFrame): the file's data, with empty fields as NaN
+
+    """
+    storage = storage_for(path)
+    if storage.typed:
+        df = storage.read(path).replace('', np.nan)
+        # numbers stored as text are numbers again
+        text = df.select_dtypes(include=[object]).columns
+        df[text] = df[text].apply(pd.to_numeric, errors='ignore')
+        return df
+
+    return pd.read_csv(
+        path,
+        dtype=str,
+        na_values=[''],
+        keep_default_na=False,
+    )
+
+
+def merge_frames(frames, keys):
+    """Merge the frames of a table's files into one with a row for each key
+
+    The frames are stacked once and each key's rows collapsed into one, so it
+    takes linear time however many files there are. A later frame's values
+    win over an earlier one's, but nulls never win, so files holding
+    different columns of the same rows are combined. A key's value stays a
+    '\N' null only if no frame has anything else for it
+
+    Rows missing any of their keys can't be told apart, so they're dropped
+    with a warning
+
+    Args:
+        frames (list of DataFrames): oldest first
+        keys (list of str): the columns identifying a row
+
+    Returns:
+        df (pandas DataFrame): the merged frame, with the columns in the order
+        they first appear
+
+    """
+    columns = []
+    for frame in frames:
+        columns.extend(column for column in frame.columns if column not in columns)
+
+    df = pd.concat(frames, ignore_index=True)
+
+    missing = df[keys].isnull().any(axis=1).values
+    if missing.any():
+        logger.warning(
+            'Dropping %d rows missing their %s', missing.sum(), ' or '.join(keys)
+        )
+        df = df[~missing].reset_index(drop=True)
+
+    text = [column for column in df.select_dtypes(include=[object]).columns
+            if column not in keys]
+    nulls = df[text] == '\N'
+    df[text] = df[text].mask(nulls)
+
+    merged = df.groupby(keys, sort=False).last()
+    if nulls.values.any():
+        was_null = nulls.groupby([df[key] for key in keys], sort=False).any()
+        merged[text] = merged[text].mask(merged[text].isnull() & was_null, '\N')
+    return merged.reset_index()[columns]
+
+
+class MergeResults(object):
+    """The tables merged during a run, shared by its workers so the tables
+        built from other tables don't have to read them back from disk
+
+    Attributes:
+        frames (dict): the merged DataFrame of each table, by table name
+
+    """
+    def __init__(self):
+        self.frames = {}
+        self._lock = Lock()
+
+    def add(self, table, df):
+        """Keep a table's merged DataFrame for the rest of the run
+
+        Args:
+            table (str): the table the frame was merged for
+            df (pandas DataFrame): the merged frame, as merge_frames returns it
+
+        """
+        with self._lock:
+            self.frames[table] = df
+
+    def get(self, table):
+        """Get a table's merged DataFrame, if it was merged during this run
+
+        Args:
+            table (str): the table to look up
+
+        Returns:
+            df (pandas DataFrame): the merged frame, or None
+
+        """
+        with self._lock:
+            return self.frames.get(table)
+
 
 class Worker(object):
-    def __init__(self, table):
+    def __init__(self, table, catalog=None, results=None):
         """The worker performs the data cleaning and standardization
         Args:
             table (str): the table type the data to process belongs to
+            catalog (FileCatalog): the index of the data directory, shared by
+                all the workers in a run so it's only walked once
+            results (MergeResults): the tables merged so far, shared by all
+                the workers in a run
 
         Returns:
             table (str): the table, so the data loader knows what to load
 
         """
         self.table = table
+        self.catalog = catalog if catalog is not None else FileCatalog(INPATH)
+        self.results = results if results is not None else MergeResults()
+        self.build_cache = BuildCache()
+        self.manifest = FileManifest()
+        self.builds = {}
+        self.input_workbooks = {}
         if not exists(OUTPATH):
             makedirs(OUTPATH)
 
     def work(self):
         """Do the needful: convert the files, run the factories, merge the output"""
-        self.excel_to_csv()
-        paths = self.get_csv_input()
-        self.remove_junk_files(paths)
+        if IN_MEMORY:
+            self.excel_to_csv_output()
+        else:
+            self.excel_to_csv()
+            paths = self.get_pending_csv_input()
+            self.remove_junk_files(paths)
 
-        paths = self.get_csv_input()
-        self.run_factories(paths)
+            paths = self.get_pending_csv_input()
+            self.run_factories(paths)
+        self.record_builds()
 
         paths = self.get_csv_output()
 
@@ -71,17 +547,21 @@ class Worker(object):
             the path, source, and filename of each csv file to be processed
 
         """
-        paths = []
-        for root, dirs, files in walk(INPATH):
-            for name in files:
-                if name.endswith('.csv') and root.split('/')[5] == 'csv_in':
-                    if root.split('/')[4] == self.table:
-                        paths.append({
-                                     'path': join(root, name),
-                                     'source': root.split('/')[4],
-                                     'filename': name
-                                     })
-        return paths
+        return get_stored_items(self.catalog, self.table, 'csv_in')
+
+    def get_pending_csv_input(self):
+        """Get the csv files converted from workbooks during this run
+
+        Returns:
+            paths (list of dicts): the csv input files still waiting to be
+            processed, skipping the ones left over from earlier runs
+
+        """
+        pending = set()
+        for build in self.builds.values():
+            pending.update(build['inputs'])
+
+        return [item for item in self.get_csv_input() if item['path'] in pending]
 
     def get_csv_output(self):
         """Search directories for processed csv files
@@ -91,73 +571,74 @@ class Worker(object):
             the path, source, and filename of each csv file to be merged
 
         """
-        paths = []
-        for root, dirs, files in walk(INPATH):
-            for name in files:
-                if name.endswith('.csv') and root.split('/')[5] == 'csv_out':
-                    if root.split('/')[4] == self.table:
-                        paths.append({
-                                     'path': join(root, name),
-                                     'source': root.split('/')[4],
-                                     'filename': name
-                                     })
-        return paths
+        return get_stored_items(self.catalog, self.table, 'csv_out')
 
     def get_excel_files(self):
         """Search directories for excel files
 
-        Args:
-            inpath (str): the path to recursively search for excel files
+        The table's xlsx directory is read again first, since the crawler
+        downloads workbooks after the catalog was built
 
         Returns:
             paths (list of dicts): contains the dict objects representing
             the path, source, and filename of each excel file to be converted
 
         """
-        paths = []
-        for root, dirs, files in walk(INPATH):
-            for name in files:
-                if '.xls' in name:
-                    if root.split('/')[4] == self.table:
-                        paths.append({
-                                     'path': join(root, name),
-                                     'source': root.split('/')[4],
-                                     'filename': name
-                                     })
-        return paths
-
-    def convert_excel_file(self, item):
-        """Convert excel files ending in .xls and .xlsx
+        self.catalog.refresh_stage(self.table, 'xlsx')
+        return [
+            item for item in self.catalog.get(self.table, 'xlsx')
+            if '.xls' in item['filename']
+        ]
+
+    def get_conversion_jobs(self, item):
+        """Split up the conversion of an excel file for the process pool
+
+        Big workbooks get a job per sheet, since their readers can read one
+        sheet without loading the others. Everything else is converted whole,
+        and so is a big workbook that can't be opened, so its job fails and
+        is logged like any other broken workbook's
 
         Args:
             item (dict): dict with keynames path, source, and filename
 
-        Output:
-            writes each tab of the file out to csv
+        Returns:
+            jobs (list of tuples): the item and the sheets for each job to convert
+
+        """
+        if getsize(item['path']) < SPLIT_WORKBOOK_BYTES:
+            return [(item, None)]
+
+        try:
+            workbook = open_reader(item['path'])
+            sheets = get_relevant_sheets(item, workbook)
+            workbook.close()
+        except Exception:
+            return [(item, None)]
+        return [(item, [name]) for name in sheets]
+
+    def add_conversions(self, results):
+        """Catalog the csv files the conversion jobs wrote
+
+        A workbook with any failed job is left out of this run's builds, so
+        none of its csv files are processed and it's converted again next run
+
+        Args:
+            results (list of tuples): the results returned by convert_workbook
 
         """
-        workbook = open_workbook(item['path'])
-
-        filename = self.strip_filename(item['filename'])
-
-        worksheets = workbook.sheet_names()
-
-        for name in worksheets:
-            sheet = workbook.sheet_by_name(name)
-            with open(
-                join(
-                    INPATH,
-                    item['source'],
-                    'csv_in',
-                    filename + '-' + name + '.csv',
-                ),
-                'wb'
-            ) as handle:
-                author = writer(handle)
-                for row in xrange(sheet.nrows):
-                    author.writerow([
-                        unicode(value).encode('utf-8') for value in sheet.row_values(row)
-                    ])
+        failed = set()
+        for item, csv_paths, error in results:
+            if error:
+                logger.error('Failed to convert %s: %s', item['filename'], error)
+                failed.add(item['filename'])
+
+            for csv_path in csv_paths:
+                self.catalog.add(csv_path)
+                self.builds[item['filename']]['inputs'].append(csv_path)
+                self.input_workbooks[csv_path] = item['filename']
+
+        for filename in failed:
+            self.builds.pop(filename, None)
 
     def strip_filename(self, filename):
         """Removes the suffix from excel files
@@ -171,19 +652,108 @@ class Worker(object):
         """
         return filename.split('.xls')[0]
 
-    def excel_to_csv(self):
-        """Convert all excel files to csvs in the source directories"""
+    def get_changed_workbooks(self):
+        """Get the jobs for the excel files that changed since they were last
+            built, and start a build for each of them
+
+        Returns:
+            jobs (list of tuples): the item and the sheets for each job to run
+
+        """
+        jobs = []
         paths = self.get_excel_files()
         for item in paths:
             if item['source'] != self.table:
                 continue
 
+            sha256 = hash_file(item['path'])[0]
+            if self.is_built(item, sha256):
+                logger.info('unchanged, reusing: %s', item['filename'])
+                continue
+
             logger.info('converting: %s', item['filename'])
-            self.convert_excel_file(item)
+            self.builds[item['filename']] = {
+                'sha256': sha256,
+                'inputs': [],
+                'outputs': [],
+            }
+            jobs.extend(self.get_conversion_jobs(item))
+
+        return jobs
+
+    def excel_to_csv(self):
+        """Convert the excel files that changed since they were last built to
+            csvs in the source directories"""
+        jobs = self.get_changed_workbooks()
+        self.add_conversions(run_in_processes(convert_workbook, jobs))
+
+    def excel_to_csv_output(self):
+        """Build the excel files that changed since they were last built
+            straight to csvs in the csv_out directories
+
+        Raises:
+            ValueError: If any of the sheets failed in its factory, after every
+            workbook has had its turn
+
+        """
+        jobs = self.get_changed_workbooks()
+
+        failed, unreadable = [], set()
+        for item, csv_paths, error, errors in run_in_processes(build_workbook, jobs):
+            if error:
+                logger.error('Failed to convert %s: %s', item['filename'], error)
+                unreadable.add(item['filename'])
+
+            for filename, error in errors:
+                logger.error('Failed to process %s: %s', filename, error)
+                failed.append(filename)
+
+            for csv_path in csv_paths:
+                self.catalog.add(csv_path)
+                self.builds[item['filename']]['outputs'].append(basename(csv_path))
+
+        for filename in unreadable:
+            self.builds.pop(filename, None)
+
+        if failed:
+            raise ValueError('Failed to process {}'.format(', '.join(failed)))
+
+    def is_built(self, item, sha256):
+        """Check if the workbook's last build can be reused
+
+        Args:
+            item (dict): dict with keynames path, source, and filename
+            sha256 (str): the hex digest of the workbook as it is now
+
+        Returns:
+            bool: True if the same bytes were built by the same version of the
+            factories and all of the build's csv_out files are still there
+
+        """
+        build = self.build_cache.get(self.table, item['filename'])
+        if build is None:
+            return False
+        if build['sha256'] != sha256 or build['version'] != FACTORY_VERSION:
+            return False
+
+        outputs = set(basename(path['path']) for path in self.get_csv_output())
+        return outputs.issuperset(build['outputs'])
+
+    def record_builds(self):
+        """Save the csv_out files built from each workbook converted during this run"""
+        for workbook, build in self.builds.items():
+            self.build_cache.record(
+                self.table,
+                workbook,
+                build['sha256'],
+                FACTORY_VERSION,
+                build['outputs'],
+            )
 
     def redistribute_data_dashboard_files(self, paths):
+        # copy rather than move, so unchanged workbooks can reuse their outputs
         for path in paths:
-            move(path['path'], join(OUTPATH, path['filename']))
+            STORAGE.export(path['path'], join(OUTPATH, path['filename']))
 
     def remove_junk_files(self, paths):
         """Remove files that don't contain relevant data
@@ -193,162 +763,48 @@ class Worker(object):
 
         """
         for path in paths:
-            if path['source'] == 'tbl_cf15':
-                continue
-
-            elif 'DataDictionary' in path['filename']:
-                remove(path['path'])
+            if is_junk_file(path['source'], path['filename']):
+                self._remove(path)
 
-            elif path['source'] == 'tbl_cf296':
-                if 'Statewide' in path['filename']:
-                    remove(path['path'])
-                elif 'Release Summary' in path['filename']:
-                    remove(path['path'])
-                elif 'Report View' in path['filename']:
-                    remove(path['path'])
+    def _remove(self, item):
+        """Delete a file and drop it from the catalog
 
-            elif path['source'] == 'tbl_churn_data':
-                continue
+        Args:
+            item (dict): dict with keynames path, source, and filename
 
-            elif path['source'] == 'tbl_data_dashboard':
-                if 'Trend' in path['filename']:
-                    remove(path['path'])
-                elif 'Updates' in path['filename']:
-                    remove(path['path'])
-                elif 'PRI_eval' in path['filename']:
-                    remove(path['path'])
-                elif 'Pivot' in path['filename']:
-                    remove(path['path'])
-                elif 'Main' in path['filename']:
-                    remove(path['path'])
-                elif 'Geomap' in path['filename']:
-                    remove(path['path'])
-                elif 'Dual_Part' in path['filename']:
-                    remove(path['path'])
-                elif 'Tiered' in path['filename']:
-                    remove(path['path'])
-                elif '_US' in path['filename']:
-                    remove(path['path'])
-
-            elif path['source'] == 'tbl_dfa256':
-                if 'Statewide' in path['filename']:
-                    remove(path['path'])
-                elif 'Release Summary' in path['filename']:
-                    remove(path['path'])
-                elif 'Report View' in path['filename']:
-                    remove(path['path'])
-
-            elif path['source'] == 'tbl_dfa296':
-                if 'Statewide' in path['filename']:
-                    remove(path['path'])
-                elif 'Release Summary' in path['filename']:
-                    remove(path['path'])
-
-            elif path['source'] == 'tbl_dfa296x':
-                if 'Statewide' in path['filename']:
-                    remove(path['path'])
-                elif 'Release Summary' in path['filename']:
-                    remove(path['path'])
-
-            elif path['source'] == 'tbl_dfa358f':
-                if 'Statewide' in path['filename']:
-                    remove(path['path'])
-                elif 'Release Summary' in path['filename']:
-                    remove(path['path'])
-
-            elif path['source'] == 'tbl_dfa358s':
-                if 'Statewide' in path['filename']:
-                    remove(path['path'])
-                elif 'Release Summary' in path['filename']:
-                    remove(path['path'])
-
-            elif path['source'] == 'tbl_stat47':
-                if 'Statewide' in path['filename']:
-                    remove(path['path'])
-                elif 'Release Summary' in path['filename']:
-                    remove(path['path'])
-
-            elif path['source'] == 'tbl_stat48':
-                if '0.csv' in path['filename']:
-                    remove(path['path'])
+        """
+        remove(item['path'])
+        self.catalog.remove(item['path'])
 
     def run_factories(self, paths):
-        """Process all the csv files in the directories specified
+        """Process all the csv files in the directories specified, each in its
+            own process from the pool
 
         Args:
             paths (list of str): all the file paths to process in the factories
 
-        """
-        for item in paths:
-            if item['source'] != self.table:
-                continue
+        Raises:
+            ValueError: If any of the files failed in its factory, after every
+            file has had its turn
 
+        """
+        items = [item for item in paths if item['source'] == self.table]
+        for item in items:
             logger.info('Processing file: %s', item['filename'])
-            factory = initialize(item)
-
-            factory.build()
-
-            if item['filename'] in [
-                'CFDashboard-Annual.csv',
-                'CFDashboard-Quarterly.csv',
-                'CFDashboard-Every_Mth.csv',
-                'CFDashboard-Every_3_Mth.csv',
-                'CFDashboard-PRI_Raw.csv',
-            ]:
-                if item['filename'] == 'CFDashboard-Annual.csv':
-                    factory.df.to_csv(
-                        join(
-                            INPATH,
-                            item['source'],
-                            'csv_out',
-                            'tbl_data_dashboard_annual.csv',
-                        ), index=False)
-                elif item['filename'] == 'CFDashboard-Quarterly.csv':
-                    factory.df.to_csv(
-                        join(
-                            INPATH,
-                            item['source'],
-                            'csv_out',
-                            'tbl_data_dashboard_quarterly.csv',
-                        ), index=False)
-                elif item['filename'] == 'CFDashboard-Every_Mth.csv':
-                    factory.df.to_csv(
-                        join(
-                            INPATH,
-                            item['source'],
-                            'csv_out',
-                            'tbl_data_dashboard_monthly.csv',
-                        ), index=False)
-                elif item['filename'] == 'CFDashboard-Every_3_Mth.csv':
-                    factory.df.to_csv(
-                        join(
-                            INPATH,
-                            item['source'],
-                            'csv_out',
-                            'tbl_data_dashboard_3mth.csv',
-                        ),
-                        index=False
-                    )
-                elif item['filename'] == 'CFDashboard-PRI_Raw.csv':
-                    factory.df.to_csv(
-                        join(
-                            INPATH,
-                            item['source'],
-                            'csv_out',
-                            'tbl_data_dashboard_pri_raw.csv',
-                        ),
-                        index=False
-                    )
+
+        failed = []
+        for item, csv_path, error in run_in_processes(build_file, items):
+            if error:
+                logger.error('Failed to process %s: %s', item['filename'], error)
+                failed.append(item['filename'])
             else:
-                factory.df.to_csv(
-                    join(
-                        INPATH,
-                        item['source'],
-                        'csv_out',
-                        item['filename'],
-                    ),
-                    index=False
-                )
+                self.catalog.add(csv_path)
+                workbook = self.input_workbooks.get(item['path'])
+                if workbook in self.builds:
+                    self.builds[workbook]['outputs'].append(basename(csv_path))
+
+        if failed:
+            raise ValueError('Failed to process {}'.format(', '.join(failed)))
 
     def merge_for_uploading(self, paths):
         """Merge all the csv files in the directories specified for uploading to the database
@@ -356,54 +812,105 @@ class Worker(object):
         Args:
             paths (list of dicts): each dict has a path, source, and filename
             to be used to read in csv files and then merge them according
-            to their source
+            to their source, keeping one row for each of the table's keys
 
         Output:
             writes merged csv files out to the outpath
 
         """
-        sibling = paths[0]['source']
-        old = pd.read_csv(paths[0]['path'])
+        for sibling, items in groupby(paths, key=itemgetter('source')):
+            df = self.merge_table(sibling, items)
+            self.results.add(sibling, df)
 
-        for item in paths[1:]:
+            df.to_csv(join(OUTPATH, sibling + '.csv'), index=False)
+            logger.info('Merged files for %s', sibling)
 
-            new = pd.read_csv(item['path'])
+    def merge_table(self, table, paths):
+        """Merge a table's csv files into one DataFrame
 
-            if item['source'] == sibling:
-                old = pd.merge(old, new, how='outer')
-            else:
-                old.to_csv(join(OUTPATH, sibling + '.csv'), index=False)
-                old = new
-                sibling = item['source']
+        Args:
+            table (str): the table the files belong to
+            paths (iterable of dicts): each dict has a path, source, and filename
 
-        old.to_csv(join(OUTPATH, sibling + '.csv'), index=False)
-        logger.info('Merged files for %s', sibling)
+        Returns:
+            df (pandas DataFrame): a row for each of the table's keys
 
-        if self.table in ['tbl_dfa358f', 'tbl_dfa358s']:
-            self.combine_358F_and_S()
+        """
+        paths = sorted(paths, key=self.get_merge_order(table))
+        frames = [read_for_merging(item['path']) for item in paths]
+        return merge_frames(frames, merge_keys)
 
-    def combine_358F_and_S(self):
-        """Combines the tbl_dfa358f and tbl_dfa358s files for uploading
+    def get_merge_order(self, table):
+        """Get the sort key putting a table's csv_out files in the order they're merged
+
+        The files built from the workbook whose content changed last win where
+        files overlap, so a republished report replaces the one it revises,
+        while fetching the same bytes again changes nothing. Files whose
+        workbook was never fetched come first, and the filename breaks ties,
+        so the order doesn't depend on which process finished writing first
 
         Args:
-            outpath (str): path to the directory of the tbl_dfa358f and tbl_dfa358s files
+            table (str): the table the files belong to
+
+        Returns:
+            key (function): gets the change time and filename of a file's item
+
+        """
+        workbooks = self.build_cache.workbooks(table)
+        changed = self.manifest.changed(table)
+
+        def key(item):
+            workbook = workbooks.get(basename(item['path']))
+            return changed.get(workbook, ''), item['filename']
+        return key
+
+    def get_merged(self, table):
+        """Get a table as it was merged during this run
+
+        A table whose worker hasn't merged it in this run is merged from its
+        csv_out files instead, rather than read from an output file an earlier
+        run left, with a warning since the files may be out of date
+
+        Args:
+            table (str): the table to get
+
+        Returns:
+            df (pandas DataFrame): the merged table
+
+        """
+        df = self.results.get(table)
+        if df is None:
+            logger.warning(
+                '%s was not merged in this run, merging its csv_out files, '
+                'which may be out of date',
+                table,
+            )
+            paths = get_stored_items(self.catalog, table, 'csv_out')
+            df = self.merge_table(table, paths)
+        return df
+
+    def combine_358F_and_S(self):
+        """Combines the tbl_dfa358f and tbl_dfa358s tables for uploading
+
+        The merged tables are taken from this run's results, so the total is
+        never built from a stale sibling. Their counts are summed as numbers,
+        grouped on an index of the keys
 
         Output:
-            csv file named tbl_dfa358tot in the same outpath directory
+            csv file named tbl_dfa358tot in the outpath directory
 
         Raises:
             ValueError: If the combined file is empty, something went wrong
 
         """
-        df1 = pd.read_csv(join(OUTPATH, 'tbl_dfa358f.csv'))
-        df2 = pd.read_csv(join(OUTPATH, 'tbl_dfa358s.csv'))
+        keys = ['county', 'fulldate', 'year', 'quarter', 'month']
+        frames = [self.get_merged(table) for table in ['tbl_dfa358f', 'tbl_dfa358s']]
 
-        df3 = df1.append(df2, ignore_index=True)
-        df3 = df3.groupby(
-            [df3.county, df3.fulldate, df3.year, df3.quarter, df3.month]
-        ).sum()
+        df = pd.concat(frames, ignore_index=True).set_index(keys)
+        df = df.apply(pd.to_numeric, errors='coerce')
+        df = df.groupby(level=keys).sum()
 
-        if df3.empty:
+        if df.empty:
             raise ValueError
 
-        df3.to_csv(join(OUTPATH, 'tbl_dfa358tot.csv'))
+        df.to_csv(join(OUTPATH, 'tbl_dfa358tot.csv'))
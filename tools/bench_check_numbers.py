@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Compare the cell by cell loop FileFactory.check_numbers used to clean the
+number columns with against the column at a time version, using the csv_in
+files under data/ and the test fixture
+
+Usage:
+    python tools/bench_check_numbers.py [--data /etc/calfresh/data] [--repeat 3] [tables...]
+
+"""
+
+from string import digits
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calfresh'))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from file_factory import CF296Factory  # noqa: E402
+from worker import INPATH  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'calfresh', 'tests', 'test_data.csv')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('tables', nargs='*',
+                    help='the tables to clean, all of them by default')
+parser.add_argument('--data', default=INPATH,
+                    help='the directory of the tables')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='how many times to clean every table')
+args = parser.parse_args()
+
+
+def get_paths(table):
+    directory = os.path.join(args.data, table, 'csv_in')
+    if not os.path.isdir(directory):
+        return []
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if name.endswith('.csv')
+    ]
+
+
+def get_valid_number(num):
+    """How check_numbers used to clean each cell"""
+    if num is None:
+        return np.nan
+
+    try:
+        return float(num)
+    except ValueError:
+        num = ''.join(c for c in num if c in digits + '.')
+
+    try:
+        return float(num)
+    except ValueError:
+        return np.nan
+
+
+def by_cell(factory):
+    for col in factory.df.columns[1:]:
+        i = 0
+        for row in factory.df[col]:
+            factory.df.loc[i, col] = get_valid_number(row)
+            i += 1
+
+
+def by_column(factory):
+    factory.check_numbers()
+
+
+def read_factories(paths):
+    """Read each file once, so only the cleaning is timed"""
+    factories = []
+    for path in paths:
+        try:
+            factories.append(CF296Factory({'filename': os.path.basename(path), 'path': path}))
+        except ValueError:  # empty
+            pass
+    return factories
+
+
+def run(clean, factories):
+    """Clean a fresh copy of every factory's frame"""
+    for factory, df in factories:
+        factory.df = df.copy()
+        clean(factory)
+
+
+tables = args.tables or sorted(
+    table for table in os.listdir(args.data) if get_paths(table)
+)
+jobs = [('fixture', [FIXTURE])] + [(table, get_paths(table)) for table in tables]
+
+print('{:<20} {:>5} {:>8} {:>10} {:>10} {:>8}'.format(
+    'table', 'files', 'cells', 'by cell', 'by column', 'speedup'))
+for table, paths in jobs:
+    factories = [(factory, factory.df.copy()) for factory in read_factories(paths)]
+
+    # both ways have to agree before timing means anything
+    for factory, df in factories:
+        run(by_cell, [(factory, df)])
+        expected = factory.df
+        run(by_column, [(factory, df)])
+        try:
+            pd.util.testing.assert_frame_equal(expected, factory.df)
+        except AssertionError as ex:
+            sys.exit('Cleaned values differ for {}: {}'.format(factory.filename, ex))
+
+    cells = sum(df.shape[0] * (df.shape[1] - 1) for _, df in factories)
+    baseline = min(timeit.repeat(lambda: run(by_cell, factories), number=1, repeat=args.repeat))
+    vectorized = min(timeit.repeat(lambda: run(by_column, factories), number=1, repeat=args.repeat))
+    print('{:<20} {:>5} {:>8} {:>9.3f}s {:>9.3f}s {:>7.1f}x'.format(
+        table, len(factories), cells, baseline, vectorized, baseline / vectorized))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Compare the pairwise outer merge merge_for_uploading used to fold a table's
+csv_out files together with against the single concat and keyed merge, using
+the files under data/
+
+Usage:
+    python tools/bench_merge.py [--data /etc/calfresh/data] [--repeat 3] [tables...]
+
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calfresh'))
+
+import pandas as pd  # noqa: E402
+
+import worker  # noqa: E402
+from constants import merge_keys  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('tables', nargs='*',
+                    help='the tables to merge, all of them by default')
+parser.add_argument('--data', default=worker.INPATH,
+                    help='the directory of the tables')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='how many times to merge every table')
+args = parser.parse_args()
+
+
+def get_paths(table):
+    directory = os.path.join(args.data, table, 'csv_out')
+    if not os.path.isdir(directory):
+        return []
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if name.endswith('.csv')
+    ]
+
+
+def fold(paths):
+    old = pd.read_csv(paths[0])
+    for path in paths[1:]:
+        old = pd.merge(old, pd.read_csv(path), how='outer')
+    return old
+
+
+def concat(paths, keys):
+    frames = [worker.read_for_merging(path) for path in paths]
+    return worker.merge_frames(frames, keys)
+
+
+def read_back(df, keys):
+    """Write a merged frame out and read it back typed, in key order
+
+    The fold parses every value and writes it back out, so its floats can pick
+    up digits the files never had. The values are compared, not their text
+    """
+    path = '/tmp/bench_merge.csv'
+    df.to_csv(path, index=False)
+    df = pd.read_csv(path, na_values=['\N'])
+    return df.sort_values(keys).reset_index(drop=True)
+
+
+tables = args.tables or sorted(
+    table for table in os.listdir(args.data)
+    if table != 'tbl_data_dashboard' and len(get_paths(table)) > 1
+)
+
+print('{:<16} {:>5} {:>6} {:>10} {:>10} {:>8}'.format(
+    'table', 'files', 'rows', 'fold', 'concat', 'speedup'))
+for table in tables:
+    paths = get_paths(table)
+    keys = merge_keys
+
+    # both ways have to agree before timing means anything
+    expected = read_back(fold(paths), keys)
+    merged = read_back(concat(paths, keys), keys)
+    if expected.duplicated(keys).any():
+        print('{}: the fold kept more than one row for some keys'.format(table))
+    else:
+        try:
+            pd.util.testing.assert_frame_equal(expected, merged, check_dtype=False)
+        except AssertionError as ex:
+            sys.exit('Merged rows differ for {}: {}'.format(table, ex))
+
+    baseline = min(timeit.repeat(lambda: fold(paths), number=1, repeat=args.repeat))
+    linear = min(timeit.repeat(lambda: concat(paths, keys), number=1, repeat=args.repeat))
+    print('{:<16} {:>5} {:>6} {:>9.3f}s {:>9.3f}s {:>7.1f}x'.format(
+        table, len(paths), len(merged), baseline, linear, baseline / linear))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Compare the BeautifulSoup tree PageParser used to build against the
+streaming LinkExtractor, using the pages saved in temp/
+
+Usage:
+    python tools/bench_page_parser.py [--temp /etc/calfresh/temp] [--repeat 5]
+
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calfresh'))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import web_crawler  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--temp', default=web_crawler.temp_dir,
+                    help='the directory of saved html pages')
+parser.add_argument('--repeat', type=int, default=5,
+                    help='how many times to parse every page')
+args = parser.parse_args()
+
+pages = [
+    os.path.join(args.temp, name) for name in sorted(os.listdir(args.temp))
+    if not name.endswith('.part')
+]
+if not pages:
+    sys.exit('No saved pages in {}'.format(args.temp))
+
+
+def soup_links():
+    for page in pages:
+        with open(page, 'r') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        set(str(url.get('href')) for url in soup.find_all('a'))
+
+
+def extractor_links():
+    web_crawler._link_cache.clear()  # time the parsing, not the cache
+    for page in pages:
+        web_crawler.extract_links(page)
+
+
+def cached_links():
+    for page in pages:
+        web_crawler.extract_links(page)
+
+
+for page in pages:  # both paths have to agree before timing means anything
+    with open(page, 'r') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    expected = set(str(url.get('href')) for url in soup.find_all('a'))
+    if web_crawler.extract_links(page) != expected:
+        sys.exit('Links differ for {}'.format(page))
+
+baseline = min(timeit.repeat(soup_links, number=1, repeat=args.repeat))
+streaming = min(timeit.repeat(extractor_links, number=1, repeat=args.repeat))
+cached = min(timeit.repeat(cached_links, number=1, repeat=args.repeat))
+
+print('{} pages'.format(len(pages)))
+print('BeautifulSoup tree:  {:.4f}s'.format(baseline))
+print('LinkExtractor:       {:.4f}s ({:.1f}x)'.format(streaming, baseline / streaming))
+print('LinkExtractor cache: {:.6f}s'.format(cached))
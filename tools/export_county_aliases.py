@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""Write the county aliases the factories have confirmed to a csv file, so the
+misspellings and the counties they were taken for can be reviewed
+
+Usage:
+    python tools/export_county_aliases.py [--state /etc/calfresh/state.db] [out.csv]
+
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calfresh'))
+
+from state import CountyAliases, state_path  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument('out', nargs='?', default='county_aliases.csv',
+                    help='the csv file to write')
+parser.add_argument('--state', default=state_path,
+                    help='the SQLite database the aliases are saved in')
+args = parser.parse_args()
+
+count = CountyAliases(args.state).export(args.out)
+print('Wrote {} aliases to {}'.format(count, args.out))